@@ -1,10 +1,13 @@
 import os
 
-from microchain import MistralChatGenerator, LLM, Function, Engine, Agent
+from microchain import MistralChatGenerator, LLM, Function, Engine, Agent, configure_logging
 from microchain.functions import Reasoning, Stop
 from dotenv import load_dotenv
 
 from microchain import OpenAIChatGenerator
+
+configure_logging()
+
 MODES = ["mistral", "openai", "local"]
 MODE = MODES[2]
 
@@ -85,6 +88,9 @@ def get_generator():
 
 
 class Add(Function):
+    parallel_safe = True
+    pure = True
+
     @property
     def description(self):
         return "Use Add(a: int, b: int) to compute the sum of two constants."
@@ -97,6 +103,9 @@ class Add(Function):
         return a + b
 
 class Subtract(Function):
+    parallel_safe = True
+    pure = True
+
     @property
     def description(self):
         return "Use Subtract(a: int, b: int) for (a-b)."
@@ -109,6 +118,9 @@ class Subtract(Function):
         return a - b
 
 class Multiply(Function):
+    parallel_safe = True
+    pure = True
+
     @property
     def description(self):
         return "Use Multiply(a: int, b: int) for (a*b)."
@@ -121,6 +133,9 @@ class Multiply(Function):
         return a * b
 
 class Power(Function):
+    parallel_safe = True
+    pure = True
+
     @property
     def description(self):
         return "Use Power(a: int, b: int) for (a**b)."
@@ -2,9 +2,11 @@ import os
 import random
 from dotenv import load_dotenv   # pip install python-dotenv
 
-from microchain import OpenAITextGenerator, HFChatTemplate, LLM, Function, Engine, Agent
+from microchain import OpenAITextGenerator, HFChatTemplate, LLM, Function, Engine, Agent, configure_logging
 from microchain.functions import Reasoning, Stop
 
+configure_logging()
+
 class Sum(Function):
     @property
     def description(self):
@@ -3,9 +3,11 @@ import random
 from dotenv import load_dotenv   # pip install python-dotenv
 from tictactoe import Board      # pip install python-tictactoe
 
-from microchain import OpenAITextGenerator, HFChatTemplate, LLM, Function, Engine, Agent
+from microchain import OpenAITextGenerator, HFChatTemplate, LLM, Function, Engine, Agent, configure_logging
 from microchain.functions import Reasoning, Stop
 
+configure_logging()
+
 def check_win(board):
     if board.has_won(1):
         return "You won!"
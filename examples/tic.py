@@ -3,9 +3,11 @@ import random
 from dotenv import load_dotenv   # pip install python-dotenv
 from tictactoe import Board      # pip install python-tictactoe
 
-from microchain import MistralTextGenerator, LLM, Function, Engine, Agent
+from microchain import MistralTextGenerator, LLM, Function, Engine, Agent, configure_logging
 from microchain.functions import Reasoning, Stop
 
+configure_logging()
+
 load_dotenv()
 assert "MISTRAL_API_KEY" in os.environ, "Please set the MISTRAL_API_KEY environment variable"
 MISTRAL_KEY = os.environ["MISTRAL_API_KEY"]
@@ -1,7 +1,22 @@
-from microchain.models.mistralai_generator import MistralChatGenerator
-from microchain.models.openai_generator import OpenAIChatGenerator
+from microchain.models.mistralai_generator import MistralChatGenerator, AsyncMistralChatGenerator
+from microchain.models.openai_generator import OpenAIChatGenerator, AsyncOpenAIChatGenerator
 # from microchain.models.templates import HFChatTemplate, VicunaTemplate
 from microchain.models.llm import LLM
+from microchain.models.generator import Generator, GeneratorError, TokenUsage, ToolCall, ToolReply
+from microchain.models.resilience import ResilientGenerator
+from microchain.models.mock_generator import MockGenerator, ScriptedGenerator, CalcOracleGenerator
+from microchain.models.transport import Transport, get_default_transport, set_default_transport
+from microchain.models.cache import CachedGenerator, CacheMiss, MemoryResponseStore, SQLiteResponseStore
 from microchain.engine.function import Function, FunctionResult
 from microchain.engine.engine import Engine
-from microchain.engine.agent import Agent
\ No newline at end of file
+from microchain.engine.state import State
+from microchain.engine.registry import Registry
+from microchain.engine.agent import Agent
+from microchain.engine.async_agent import AsyncAgent
+from microchain.engine.batch import BatchRunner, RateLimiter
+from microchain.engine.run_store import JSONLRunStore, SQLiteRunStore
+from microchain.engine.retrieval import ToolIndex, ToolSelector
+from microchain.engine.checkpoint import FileCheckpointer, JSONStateSerializer, PickleStateSerializer
+from microchain.engine.history import HistoryPolicy, SlidingWindow, CollapseReasoning, DropErrors, Summarize
+from microchain.tracing import Tracer, JSONLExporter, MemoryExporter, get_tracer, set_tracer
+from microchain.log import configure_logging
\ No newline at end of file
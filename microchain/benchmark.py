@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from time import perf_counter, strftime
+
+from microchain import Function, Engine, Agent, AsyncAgent, LLM, configure_logging
+from microchain.functions import Reasoning, Stop
+from microchain.models.mock_generator import CalcOracleGenerator, ScriptedGenerator
+from microchain.tracing import Tracer, MemoryExporter, get_tracer, set_tracer
+
+# Framework overhead only: every model reply comes from CalcOracleGenerator.
+#   python -m microchain.benchmark --output bench.json
+#   python -m microchain.benchmark --compare bench.json
+
+class Add(Function):
+    description = "Use Add(a: int, b: int) to compute the sum of two constants"
+    example_args = [2, 2]
+
+    def __call__(self, a: int, b: int):
+        return a + b
+
+class Subtract(Function):
+    description = "Use Subtract(a: int, b: int) to compute the difference of two constants"
+    example_args = [2, 2]
+
+    def __call__(self, a: int, b: int):
+        return a - b
+
+class Multiply(Function):
+    description = "Use Multiply(a: int, b: int) to compute the product of two constants"
+    example_args = [2, 2]
+
+    def __call__(self, a: int, b: int):
+        return a * b
+
+class Power(Function):
+    description = "Use Power(a: int, b: int) to compute a to the power of b"
+    example_args = [2, 2]
+
+    def __call__(self, a: int, b: int):
+        return a ** b
+
+# Higher is better for throughput, lower is better for everything else
+HIGHER_IS_BETTER = ("per_sec",)
+# Throughput is the best of a few rounds to keep the comparison stable
+ROUNDS = 3
+
+def expression(terms):
+    # (1+2)*(3-1)+(2+3)*(4-2)+... with 2 operations per term plus the joins
+    parts = [f"({index % 7 + 1}+{index % 5 + 2})*({index % 3 + 4}-{index % 2 + 1})" for index in range(terms)]
+    return "+".join(parts)
+
+def build_engine():
+    engine = Engine(state=dict())
+    for function in (Reasoning(), Stop(), Add(), Subtract(), Multiply(), Power()):
+        engine.register(function)
+    return engine
+
+def build_agent(generator, terms, agent_class=Agent, plan_mode=False):
+    engine = build_engine()
+    agent = agent_class(llm=LLM(generator=generator), engine=engine, max_steps=10 * terms + 10, session_tokens=10 ** 9, plan_mode=plan_mode)
+    agent.system_message = f"Act as a calculator. Allowed functions:\n{engine.help}"
+    agent.prompt = f"Evaluate `{expression(terms)}`"
+    return agent
+
+def percentiles(values):
+    values = sorted(values)
+    pick = lambda fraction: values[min(len(values) - 1, int(fraction * len(values)))]
+    return dict(p50=round(pick(0.5) * 1000, 3), p95=round(pick(0.95) * 1000, 3), p99=round(pick(0.99) * 1000, 3), max=round(values[-1] * 1000, 3))
+
+def bench_engine(calls):
+    engine = build_engine()
+    engine.bind(build_agent(CalcOracleGenerator(), 1))
+    engine.help
+    commands = [f"Add({index}, {index % 10})" for index in range(1000)] + ['Reasoning("thinking")', "Multiply(3, 4)"]
+    for command in commands:
+        engine.execute(command)
+    elapsed = float("inf")
+    for _ in range(ROUNDS):
+        start = perf_counter()
+        for index in range(calls):
+            engine.execute(commands[index % len(commands)])
+        elapsed = min(elapsed, perf_counter() - start)
+    return dict(engine_execute_per_sec=round(calls / elapsed, 1))
+
+def bench_agent(runs, terms):
+    elapsed = float("inf")
+    for _ in range(ROUNDS):
+        steps = 0
+        start = perf_counter()
+        for _ in range(runs):
+            agent = build_agent(CalcOracleGenerator(), terms)
+            agent.run()
+            steps += agent.step_count
+        elapsed = min(elapsed, perf_counter() - start)
+    return dict(agent_steps_per_sec=round(steps / elapsed, 1), agent_runs_per_sec=round(runs / elapsed, 2))
+
+def bench_plan_stream(terms):
+    # A streamed multi-line plan must run in one call, not be cut at its first command
+    commands = CalcOracleGenerator().plan(expression(terms)) + ["Stop()"]
+    generator = ScriptedGenerator(["\n".join(commands)], stream=True)
+    agent = build_agent(generator, terms, plan_mode=True)
+    agent.run()
+    return dict(plan_stream_llm_calls=generator.calls)
+
+def bench_memory(terms):
+    # Memory the agent keeps per executed step (history, counters, caches)
+    tracemalloc.start()
+    agent = build_agent(CalcOracleGenerator(), 1)
+    agent.run()
+    baseline = tracemalloc.get_traced_memory()[0]
+    agent = build_agent(CalcOracleGenerator(), terms)
+    agent.run()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dict(memory_bytes_per_step=round((current - baseline) / max(1, agent.step_count)), memory_peak_kb=round(peak / 1024))
+
+def bench_concurrency(sessions, terms, latency, jitter):
+    # Step latency under load: the oracle sleeps like a provider, the framework must not add a tail
+    exporter = MemoryExporter(max_spans=None)
+    previous = get_tracer()
+    set_tracer(Tracer([exporter]))
+    generator = CalcOracleGenerator(latency=latency, jitter=jitter)
+
+    async def main():
+        agents = [build_agent(generator, terms, AsyncAgent) for _ in range(sessions)]
+        return await asyncio.gather(*(agent.arun() for agent in agents))
+
+    try:
+        start = perf_counter()
+        asyncio.run(main())
+        elapsed = perf_counter() - start
+    finally:
+        set_tracer(previous)
+    steps = [span for span in exporter.spans if span.name == "agent.step"]
+    llm_times = dict()
+    for span in exporter.spans:
+        if span.name == "llm.call":
+            llm_times[span.parent_id] = llm_times.get(span.parent_id, 0) + span.duration
+    step_times = [span.duration for span in steps]
+    overhead = [span.duration - llm_times.get(span.span_id, 0) for span in steps]
+    result = dict(concurrent_steps_per_sec=round(len(step_times) / elapsed, 1))
+    result.update({f"concurrent_step_ms_{name}": value for name, value in percentiles(step_times).items()})
+    result.update({f"concurrent_overhead_ms_{name}": value for name, value in percentiles(overhead).items()})
+    return result
+
+def run_benchmarks(quick=False, sessions=50, latency=0.02, jitter=0.01):
+    scale = 1 if quick else 5
+    results = dict()
+    results.update(bench_engine(20000 * scale))
+    results.update(bench_agent(4 * scale, 10))
+    results.update(bench_plan_stream(10))
+    results.update(bench_memory(20 * scale))
+    results.update(bench_concurrency(sessions, 3, latency, jitter))
+    return dict(
+        time=strftime("%Y-%m-%d %H:%M:%S"),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        config=dict(quick=quick, sessions=sessions, latency=latency, jitter=jitter),
+        results=results,
+    )
+
+def compare(baseline, current, threshold):
+    # Returns the names of metrics that got worse by more than threshold
+    regressions = []
+    for name, value in current["results"].items():
+        old = baseline["results"].get(name)
+        if not old or not value:
+            continue
+        change = (value - old) / old
+        worse = change < -threshold if name.endswith(HIGHER_IS_BETTER) else change > threshold
+        if worse:
+            regressions.append(name)
+        print(f"{name:40} {old:>12} -> {value:>12} ({change:+.1%}){'  REGRESSION' if worse else ''}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure microchain's own overhead with an offline oracle model")
+    parser.add_argument("--quick", action="store_true", help="smaller workloads")
+    parser.add_argument("--sessions", type=int, default=50, help="concurrent AsyncAgent sessions")
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated model latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="+/- random latency in seconds")
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args(argv)
+
+    configure_logging(level=logging.ERROR)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        # Agents save their history to logs/ when a run ends, keep that out of the caller's tree
+        os.chdir(directory)
+        try:
+            report = run_benchmarks(args.quick, args.sessions, args.latency, args.jitter)
+        finally:
+            os.chdir(cwd)
+
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
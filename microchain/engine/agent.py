@@ -1,16 +1,26 @@
-from termcolor import colored
-from os.path import exists
-from json import dump as json_dump
+import os
+from json import dump as json_dump, dumps as json_dumps
+from hashlib import sha256
 
 from microchain.engine.function import Function, FunctionResult
 from microchain.models.llm import LLM
 from microchain.engine.engine import Engine
+from microchain.engine.stream_parser import CommandStreamParser
+from microchain.engine.command import split_commands, plan_steps
+from microchain.engine.history import SlidingWindow, split_turns, join_turns
+from microchain.engine.run_store import new_run_id
+from microchain.engine.checkpoint import CHECKPOINT_VERSION
+from microchain.models.tokenizer import get_token_counter
+from microchain.models.generator import GeneratorError
+from microchain.tracing import get_tracer, current_span
+from microchain.log import log, DEBUG, INFO, WARNING, ERROR
 AGENT_MAX_TRIES = 3
 MAX_STEPS = 10
 MAX_SESSION_TOKENS = 30000
+FALLBACK_REPLY = 'Reasoning("After following the plan step-by-step, I will call Stop() at the goal.")'
 from time import time
 class Agent:
-    def __init__(self, llm: LLM, engine: Engine, max_tries=AGENT_MAX_TRIES, max_steps=MAX_STEPS, session_tokens=MAX_SESSION_TOKENS, success_fn = lambda _: True):
+    def __init__(self, llm: LLM, engine: Engine, max_tries=AGENT_MAX_TRIES, max_steps=MAX_STEPS, session_tokens=MAX_SESSION_TOKENS, success_fn = lambda _: True, history_policies=None, token_counter=None, compact_over_budget=True, candidates=1, plan_mode=False, run_store=None, checkpointer=None, tool_selector=None):
         self.llm = llm
         self.engine = engine
 
@@ -26,6 +36,10 @@ class Agent:
         self.reset()
 
         self.total_tokens = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.prefix_fingerprint = None
         self.success_step_count = None
         self.finish_reason = None
 
@@ -34,15 +48,101 @@ class Agent:
         self.last_output = None
         self.is_valid_goal_value = success_fn
 
+        # Applied in order to the history before each LLM call, see microchain.engine.history
+        self.history_policies = history_policies or []
+        self.context_tokens = 0
+        # Local tokenizer used to estimate each request before it is sent
+        self.token_counter = token_counter or get_token_counter(getattr(llm.generator, "model", None))
+        # When the next call would exceed the session budget, trim old turns instead of aborting
+        self.compact_over_budget = compact_over_budget
+        # Sample this many replies per call and keep the first one the engine accepts
+        self.candidates = candidates
+        # Execute every command of a multi-line reply or PlanSteps([...]) before asking the model again
+        self.plan_mode = plan_mode
+        # JSONLRunStore or SQLiteRunStore that records every turn as it happens, see
+        # microchain.engine.run_store. Without one the history is saved to logs/ at the end.
+        self.run_store = run_store
+        self.run_id = None
+        # FileCheckpointer saving the session every few steps so run(resume=True) can pick it up
+        self.checkpointer = checkpointer
+        # ToolSelector that shows the model only the functions relevant to the prompt,
+        # see microchain.engine.retrieval. system_message must not embed engine.help then.
+        self.tool_selector = tool_selector
+        self.selected_functions = None
+        self.selected_system_message = None
+
     def reset(self):
         self.history = []
+        self.head_length = 0
         self.do_stop = False
+        self.step_count = 0
+        self.finish_reason = None
+        self.success_step_count = None
+        self.checkpoint_step = 0
+
+    def checkpoint(self):
+        return dict(
+            version=CHECKPOINT_VERSION,
+            run_id=self.run_id,
+            prompt=self.prompt,
+            step_count=self.step_count,
+            history=self.history,
+            head_length=self.head_length,
+            total_tokens=self.total_tokens,
+            prompt_tokens=self.prompt_tokens,
+            completion_tokens=self.completion_tokens,
+            cached_tokens=self.cached_tokens,
+            prefix_fingerprint=self.prefix_fingerprint,
+            last_output=self.last_output,
+            engine_state=self.engine.state_dict(),
+        )
+
+    def restore(self, checkpoint):
+        if checkpoint["prompt"] != self.prompt:
+            raise ValueError("The checkpoint was saved for a different prompt")
+        for name in ("run_id", "step_count", "history", "head_length", "total_tokens", "prompt_tokens",
+                     "completion_tokens", "cached_tokens", "prefix_fingerprint", "last_output"):
+            setattr(self, name, checkpoint[name])
+        # Functions hold a reference to engine.state, so update it in place
+        self.engine.state.clear()
+        self.engine.state.update(checkpoint["engine_state"])
+        self.checkpoint_step = self.step_count
+
+    def save_checkpoint(self, force=False):
+        if self.checkpointer is None:
+            return
+        if force or self.step_count - self.checkpoint_step >= self.checkpointer.every:
+            self.write_checkpoint(self.checkpointer.dumps(self.checkpoint()))
+            self.checkpoint_step = self.step_count
+
+    def write_checkpoint(self, data):
+        self.checkpointer.write(data)
+
+    def select_functions(self):
+        query = self.prompt
+        if self.tool_selector.per_step:
+            # The latest command and its output say what the model needs next
+            query += "\n" + "\n".join(str(message["content"]) for message in self.history[self.head_length:][-2:])
+        selected = self.tool_selector(query)
+        if selected != self.selected_functions:
+            log(DEBUG, "Selected functions: %s", selected)
+            self.selected_functions = selected
+            self.selected_system_message = self.system_message + "\n" + self.engine.help_for(selected)
+
+    def refresh_tools(self):
+        if self.tool_selector is not None and self.tool_selector.per_step:
+            self.select_functions()
+
+    def system_prompt(self):
+        if self.tool_selector is None:
+            return self.system_message
+        return self.selected_system_message
 
     def build_initial_messages(self):
         self.history = [ # This should be role:"system, <content>:"System instructions"
             dict(
                 role="system",
-                content=self.system_message
+                content=self.system_prompt()
             )
         ]
         # if self.example_prompt:
@@ -52,10 +152,14 @@ class Agent:
         #     ))
         if self.bootstrap:
             self.apply_commands(self.bootstrap, no_stop=True)
+        # The system message and bootstrap transcript are identical for every step
+        # and every run of this configuration, so they form the cacheable prefix.
+        self.prefix_fingerprint = fingerprint_messages(self.history)
         self.history.append(dict(
             role="user",
             content=self.prompt
         ))
+        self.head_length = len(self.history)
     
     def apply_commands(self, commands: list[str], no_stop = False):
         for command in commands:
@@ -69,8 +173,8 @@ class Agent:
             if result == FunctionResult.ERROR:
                 raise Exception(f"Your bootstrap commands contain an error. output={output}")
 
-            print(colored(f">> {command}", "blue"))
-            print(colored(f"{output}", "green"))
+            log(INFO, ">> %s", command, color="blue")
+            log(INFO, "%s", output, color="green")
 
             self.history.append(dict(
                 role="assistant",
@@ -88,7 +192,7 @@ class Agent:
                 # logic here for reasoning and others
                 if function_name == "PlanSteps":
                     if self.is_valid_goal_value(reply):
-                        print(f'Got plan! {reply}')
+                        log(DEBUG, 'Got plan! %s', reply)
                         self.last_output = reply
                         return 'Stop()'
                     pass
@@ -99,140 +203,414 @@ class Agent:
                     
                 return reply
             continue
-        return 'Reasoning("After following the plan step-by-step, I will call Stop() at the goal.")'
+        return FALLBACK_REPLY
 
     def stop(self):
         self.do_stop = True
 
+    def check_abort(self, tries):
+        if self.do_stop:
+            return True
+
+        if tries > self.max_tries:
+            log(ERROR, "Tried %s times (agent.max_tries) Aborting", self.max_tries, color="red")
+            return True
+
+        if self.total_tokens > self.max_session_tokens:
+            log(ERROR, "Exceeded %s tokens. Aborting", self.max_session_tokens, color="red")
+            return True
+        return False
+
+    def count_message_tokens(self, messages):
+        return self.token_counter.count_messages(messages)
+
+    def context(self):
+        messages = self.history
+        if self.tool_selector is not None and messages and messages[0]["content"] != self.selected_system_message:
+            # A per-step selection changed the functions shown since the run started
+            messages = [dict(role="system", content=self.selected_system_message)] + messages[1:]
+        for policy in self.history_policies:
+            messages = policy(messages, self.head_length, self.count_message_tokens)
+        return messages
+
+    def retry_context(self, temp_messages):
+        # The tries of the current step, trimmed by the policies that opt in
+        turns = split_turns(temp_messages)
+        for policy in self.history_policies:
+            if policy.retries:
+                turns = policy.apply([], turns, self.count_message_tokens)
+        return join_turns(turns)
+
+    def llm_kwargs(self):
+        kwargs = dict()
+        if getattr(self.llm.generator, "stream", False) and not self.plan_mode:
+            # Let streaming generators hang up after the first complete command; a plan
+            # spans several commands, so in plan mode the whole reply is read
+            kwargs["command_parser"] = CommandStreamParser(self.engine.functions)
+        if getattr(self.llm.generator, "prompt_cache", None):
+            kwargs["cache_key"] = self.prefix_fingerprint
+        if getattr(self.llm.generator, "tool_calling", False):
+            kwargs["tools"] = self.engine.tools(self.selected_functions)
+        grammar = getattr(self.llm.generator, "grammar", None)
+        if grammar:
+            # Local servers then sample only valid calls, in plan mode one per line.
+            # max_tokens stays as configured: string arguments and digit runs are
+            # unbounded in the grammar, so it gives no useful upper bound.
+            kwargs["grammar"] = self.engine.grammar(grammar, multiple=self.plan_mode)
+        return kwargs
+
+    def max_output_tokens(self):
+        return (getattr(self.llm.generator, "max_tokens", None) or 0) * self.candidates
+
+    def prepare_messages(self, temp_messages):
+        # Pre-flight budget check: returns the messages to send, or None to abort
+        temp_messages = self.retry_context(temp_messages)
+        messages = self.context() + temp_messages
+        self.context_tokens = self.count_message_tokens(messages)
+        remaining = self.max_session_tokens - self.total_tokens - self.max_output_tokens()
+        if self.context_tokens <= remaining:
+            return messages
+
+        if self.compact_over_budget:
+            window = SlidingWindow(max_tokens=remaining - self.count_message_tokens(temp_messages))
+            compacted = window(self.context(), self.head_length, self.count_message_tokens) + temp_messages
+            compacted_tokens = self.count_message_tokens(compacted)
+            if compacted_tokens <= remaining:
+                log(WARNING, "Compacted context from ~%s to ~%s tokens to fit the session budget", self.context_tokens, compacted_tokens, color="yellow")
+                self.context_tokens = compacted_tokens
+                return compacted
+
+        log(ERROR, "Next call needs ~%s tokens but only %s are left of %s. Aborting", self.context_tokens + self.max_output_tokens(), self.max_session_tokens - self.total_tokens, self.max_session_tokens, color="red")
+        return None
+
+    def select_candidate(self, replies):
+        # Validated without executing, so no function side effects for rejected candidates
+        for reply in replies:
+            command = self.clean_reply(reply)
+            if command == FALLBACK_REPLY and reply != FALLBACK_REPLY:
+                continue
+            result, _ = self.engine.validate(command)
+            if result == FunctionResult.SUCCESS:
+                return reply
+        return replies[0] if replies else ""
+
+    def trace_usage(self, span, tokens):
+        span.set(
+            tokens_in=getattr(tokens, "prompt_tokens", None),
+            tokens_out=getattr(tokens, "completion_tokens", None),
+            tokens_cached=getattr(tokens, "cached_tokens", None),
+            tokens=int(tokens) if isinstance(tokens, int) else None,
+        )
+
+    def call_llm(self, messages):
+        with get_tracer().span("llm.call", messages=len(messages), candidates=self.candidates) as span:
+            if self.candidates > 1:
+                replies, tokens = self.llm.candidates(messages, self.candidates, **self.llm_kwargs())
+                reply = self.select_candidate(replies)
+            else:
+                reply, tokens = self.llm(messages, **self.llm_kwargs())
+            self.trace_usage(span, tokens)
+            return reply, tokens
+
+    def count_tokens(self, tokens):
+        self.total_tokens += tokens
+        if hasattr(tokens, "prompt_tokens"):
+            self.prompt_tokens += tokens.prompt_tokens
+            self.completion_tokens += tokens.completion_tokens
+            self.cached_tokens += tokens.cached_tokens
+        else:
+            # Plain int from the generator: split it using the pre-flight estimate
+            prompt_tokens = min(self.context_tokens, tokens)
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += tokens - prompt_tokens
+
+    def extract_plan(self, reply):
+        commands = split_commands(reply, self.engine.functions)
+        if len(commands) == 1 and commands[0].startswith("PlanSteps("):
+            return plan_steps(commands[0]) or []
+        return commands
+
+    def handle_plan(self, commands, temp_messages, executed):
+        # Runs the commands in order; the first error goes back to the model with
+        # the progress so far in temp_messages.
+        commands = self.trim_plan(commands, executed)
+        if self.engine.dataflow:
+            outcomes = yield "execute_plan", commands
+            return self.record_dataflow_plan(outcomes, temp_messages, executed)
+        result, command, output = FunctionResult.SUCCESS, "", ""
+        for command in commands:
+            log(INFO, ">> %s", command, color="yellow")
+            result, output = yield "execute", command
+            self.record_command(command, result, output, temp_messages, executed)
+            if result == FunctionResult.ERROR or self.do_stop:
+                break
+        return result, command, output, False
+
+    def handle_tool_calls(self, tool_calls, temp_messages, executed):
+        # Parallel tool calls of one response run in order within the step, like a plan
+        result, command, output = FunctionResult.SUCCESS, "", ""
+        for call in self.trim_plan(tool_calls, executed):
+            command = call.command
+            log(INFO, ">> %s", command, color="yellow")
+            result, output = yield "execute_call", call
+            self.record_command(command, result, output, temp_messages, executed, call)
+            if result == FunctionResult.ERROR or self.do_stop:
+                break
+        return result, command, output, False
+
+    def trim_plan(self, commands, executed):
+        return commands[:self.max_steps - self.step_count - len(executed)]
+
+    def record_dataflow_plan(self, outcomes, temp_messages, executed):
+        # Independent commands already ran concurrently, so report everything that ran
+        result, command, output = FunctionResult.SUCCESS, "", ""
+        for outcome in outcomes:
+            if outcome is None:
+                continue
+            log(INFO, ">> %s", outcome[0], color="yellow")
+            self.record_command(*outcome, temp_messages, executed)
+            if result != FunctionResult.ERROR:
+                command, result, output = outcome
+        return result, command, output, False
+
+    def turn_messages(self, command, output, call=None):
+        # A native tool call goes back as tool_calls plus a role="tool" result, so
+        # the model sees its own calls in the format it produced them
+        if call is not None:
+            return call.messages(output)
+        return [dict(
+            role="assistant",
+            content=command
+        ), dict(
+            role="user",
+            content=output
+        )]
+
+    def record_command(self, command, result, output, temp_messages, executed, call=None):
+        if type(output) != str:
+            raise ValueError('ERROR: The output from engine.execute must be a string!')
+        temp_messages.extend(self.turn_messages(command, output, call))
+        if result == FunctionResult.ERROR:
+            log(WARNING, "%s", output, color="red")
+            return
+        log(INFO, "%s", output, color="green")
+        if self.is_valid_goal_value(output):
+            self.last_output = output
+        executed.append((command, output) if call is None else (command, output, call))
+
+    def interpret_reply(self, reply, tokens):
+        # Returns ("tools", tool_calls), ("plan", commands), ("command", command) or ("abort", reply)
+        self.count_tokens(tokens)
+        tool_calls = getattr(reply, "tool_calls", None)
+        if tool_calls:
+            return "tools", tool_calls
+        if self.plan_mode:
+            commands = self.extract_plan(reply)
+            if len(commands) > 1 or (commands and reply.lstrip().startswith("PlanSteps(")):
+                return "plan", commands
+        with get_tracer().span("agent.clean_reply"):
+            reply = self.clean_reply(reply)
+
+        if len(reply) < 1:
+            log(ERROR, "Empty reply: aborting task", color="red")
+            return "abort", reply
+
+        log(INFO, ">> %s", reply, color="yellow")
+        return "command", reply
+
+    def handle_reply(self, reply, tokens, temp_messages, executed):
+        kind, reply = self.interpret_reply(reply, tokens)
+        if kind == "abort":
+            return None, reply, "", True
+        if kind == "plan":
+            return (yield from self.handle_plan(reply, temp_messages, executed))
+        if kind == "tools":
+            return (yield from self.handle_tool_calls(reply, temp_messages, executed))
+
+        result, output = yield "execute", reply
+        self.record_command(reply, result, output, temp_messages, executed)
+        return result, reply, output, False
+
+    # The step and run loops are written once, as generators that yield requests
+    # ("llm", messages), ("execute", command), ("execute_call", call),
+    # ("execute_plan", commands), ("step", None) and ("flush", None) and get the
+    # answer back. Agent answers them with blocking calls, AsyncAgent awaits them.
+    def perform(self, request, payload):
+        if request == "llm":
+            return self.call_llm(payload)
+        if request == "execute":
+            return self.engine.execute(payload)
+        if request == "execute_call":
+            return self.engine.execute_call(payload.name, payload.arguments)
+        if request == "execute_plan":
+            return self.engine.execute_plan(payload)
+        if request == "step":
+            return self.step()
+        # "flush": blocking writes are already done
+        return None
+
+    def drive(self, requests):
+        value, error = None, None
+        while True:
+            try:
+                request = requests.send(value) if error is None else requests.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            value, error = None, None
+            try:
+                value = self.perform(*request)
+            except Exception as e:
+                # Raised where the request was made, e.g. GeneratorError in step_loop
+                error = e
+
     def step(self):
+        return self.drive(self.step_loop())
+
+    def step_loop(self):
         result = FunctionResult.ERROR
         temp_messages = []
+        executed = []
         tries = 0
         abort = False
         output = ""
         reply = ""
+        self.refresh_tools()
         while result != FunctionResult.SUCCESS:
             tries += 1
-
-            if self.do_stop:
+            if self.check_abort(tries):
                 abort = True
                 break
-
-            if tries > self.max_tries:
-                print(colored(f"Tried {self.max_tries} times (agent.max_tries) Aborting", "red"))
+            
+            messages = self.prepare_messages(temp_messages)
+            if messages is None:
                 abort = True
                 break
 
-            if self.total_tokens > self.max_session_tokens:
-                print(colored(f"Exceeded {self.max_session_tokens} tokens. Aborting", "red"))
+            try:
+                reply, tokens = yield "llm", messages
+            except GeneratorError as e:
+                log(ERROR, "LLM call failed: %s. Aborting", e, color="red")
                 abort = True
                 break
-            
-            reply, tokens = self.llm(self.history + temp_messages)
-            self.total_tokens += tokens
-            reply = self.clean_reply(reply)
-
-            if len(reply) < 1:
-                print(colored("Empty reply: aborting task", "red"))
-                abort = True
-                break
-
-            print(colored(f">> {reply}", "yellow"))
-            
-            result, output = self.engine.execute(reply)
-            if type(output) != str:
-                raise ValueError('ERROR: The output from engine.execute must be a string!')
-
-            if result == FunctionResult.ERROR:
-                print(colored(output, "red"))
-                temp_messages.append(dict(
-                    role="assistant",
-                    content=reply
-                ))
-                temp_messages.append(dict(
-                    role="user",
-                    content=output
-                ))
-            else:
-                print(colored(output, "green"))
-                if self.is_valid_goal_value(output):
-                    self.last_output = output
+            result, reply, output, abort = yield from self.handle_reply(reply, tokens, temp_messages, executed)
+            if abort:
                 break
         
+        current_span().set(tries=tries, abort=abort, executed=len(executed))
         return dict(
             abort=abort,
             reply=reply,
             output=output,
+            executed=executed,
         )
 
-    def run(self):
-        max_steps = self.max_steps
+    def start_run(self, resume=False):
         if self.prompt is None:
             raise ValueError("You must set a prompt before running the agent")
 
         if self.example_prompt:
-            print(colored(f"Example prompt:\n{self.example_prompt}", "blue"))
+            log(INFO, "Example prompt:\n%s", self.example_prompt, color="blue")
 
         self.reset()
-        start_time = time()
+        self.start_time = time()
+        if self.tool_selector is not None:
+            self.selected_functions = None
+            self.select_functions()
         
-        self.build_initial_messages()
-        print(colored(f"Prompt:\n{self.prompt}", "blue"))
-        print(colored(f"Running {max_steps} steps", "green"))
-
-        step_count = 0
-        # finish_reasons = ['Exhausted', 'Aborted', 'Completed']
-        for i in range(max_steps):
-            if self.do_stop:
-                break
+        checkpoint = self.checkpointer.load() if resume and self.checkpointer is not None else None
+        if checkpoint is not None:
+            # Completed steps are restored, not replayed, and the bootstrap is not re-executed
+            self.restore(checkpoint)
+            log(INFO, "Resuming run %s at step %s", self.run_id, self.step_count, color="green")
+        else:
+            self.run_id = new_run_id()
+            self.build_initial_messages()
+            if self.run_store is not None:
+                self.run_store.start_run(self.run_id, dict(
+                    prompt=self.prompt,
+                    model=getattr(self.llm.generator, "model", None),
+                    max_tries=self.max_tries,
+                    max_steps=self.max_steps,
+                ), self.history)
+        log(INFO, "Prompt:\n%s", self.prompt, color="blue")
+        log(INFO, "Running %s steps", self.max_steps, color="green")
 
-            step_output = self.step()
-            
-            if step_output["abort"]:
-                self.finish_reason = "Aborted"
-                break
-            
-            # we need to clear cache of old, unhelpful replies.
-            self.history.append(dict(
-                role="assistant",
-                content=step_output["reply"]
-            ))
-            self.history.append(dict(
-                role="user",
-                content=step_output["output"]
-            ))
-            step_count += 1
-            if step_count == max_steps:
-                self.finish_reason = "Exhausted"
-        
+    def record_step(self, step_output):
+        # Returns False when the run loop should stop
+        # A plan can execute several commands before it aborts, keep those
+        for entry in step_output.get("executed", []):
+            # old, unhelpful replies are trimmed from the context by self.history_policies
+            turn = self.turn_messages(*entry)
+            self.history.extend(turn)
+            if self.run_store is not None:
+                for message in turn:
+                    self.run_store.append(self.run_id, message)
+            self.step_count += 1
+        self.save_checkpoint()
+
+        if step_output["abort"]:
+            self.finish_reason = "Aborted"
+            return False
+
+        if self.step_count >= self.max_steps:
+            self.finish_reason = "Exhausted"
+            return False
+        return True
+
+    def finish_run(self):
         if self.finish_reason is None:
             self.finish_reason = "Completed"
-            self.success_step_count = step_count
+            self.success_step_count = self.step_count
+        if self.checkpointer is not None:
+            # An aborted run (e.g. the provider went down) can be resumed later
+            if self.finish_reason == "Aborted":
+                self.save_checkpoint(force=True)
+            else:
+                self.checkpointer.clear()
         
-        end_time = round(time() - start_time,2)
-        print(colored(f"{self.finish_reason} in {self.success_step_count} steps {end_time}s", "green"))
+        end_time = round(time() - self.start_time,2)
+        current_span().set(finish_reason=self.finish_reason, steps=self.step_count, tokens=self.total_tokens)
+        log(INFO, "%s in %s steps %ss", self.finish_reason, self.success_step_count, end_time, color="green")
         self.end_run()
         return self.last_output
 
+    def run(self, resume=False):
+        return self.drive(self.run_loop(resume))
+
+    def run_loop(self, resume=False):
+        tracer = get_tracer()
+        with tracer.span("agent.run", model=getattr(self.llm.generator, "model", None)):
+            self.start_run(resume)
+            # finish_reasons = ['Exhausted', 'Aborted', 'Completed']
+            while self.step_count < self.max_steps:
+                if self.do_stop:
+                    break
+
+                with tracer.span("agent.step", step=self.step_count):
+                    step_output = yield "step", None
+                if not self.record_step(step_output):
+                    break
+
+            # finish_run may clear the checkpoint, pending writes must land first
+            yield "flush", None
+            return self.finish_run()
+
     def save_file(self, data):
-        # save history to file
-        history_file = 'history.json'
-        if exists(history_file):
-            index = 1
-            while exists(f'history-{index}.json'):
-                index += 1
-            history_file = f'history-{index}.json'
-
-        filepath = 'logs/' + history_file
+        # save history to file, the run id keeps names unique without scanning logs/
+        os.makedirs('logs', exist_ok=True)
+        filepath = os.path.join('logs', f'history-{self.run_id}.json')
         with open(filepath, 'w') as f:
             json_dump(data, f, indent=4)
         
     def end_run(self):
-        print(colored(f"Total tokens consumed: {self.total_tokens}", "green"))
+        log(INFO, "Total tokens consumed: %s", self.total_tokens, color="green")
         model_name = self.llm.generator.model
-        session_cost = get_price(model_name, self.total_tokens)
+        session_cost = get_price(model_name, self.prompt_tokens, self.completion_tokens)
         if session_cost:
-            print(colored(f"Session cost: ${session_cost}", "green"))
+            log(INFO, "Session cost: $%s", session_cost, color="green")
+        if self.prompt_tokens:
+            log(INFO, "Input tokens: %s (%s cached, %s uncached), prefix %s", self.prompt_tokens, self.cached_tokens, self.prompt_tokens - self.cached_tokens, self.prefix_fingerprint, color="green")
+            log(INFO, "Output tokens: %s", self.completion_tokens, color="green")
         finish_message = self.finish_reason
         if self.success_step_count is not None:
             finish_message += f" in {self.success_step_count} steps"
@@ -241,19 +619,33 @@ class Agent:
             "max_tries": self.max_tries,
             "max_steps": self.max_steps,
             "session_tokens": self.total_tokens,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "prefix_fingerprint": self.prefix_fingerprint,
         },
         "prompt": self.prompt,
         "model": model_name,
         "finish": finish_message,
-        "final_answer": self.last_output or "N/A"
+        "final_answer": self.last_output or "N/A",
+        "run_id": self.run_id,
         }
+        if self.run_store is not None:
+            self.run_store.finish_run(self.run_id, config_entry)
+            return
         data = [config_entry] + self.history
         self.save_file(data)
 
-def get_price(model: str, tokens: int) -> float | None:
+def fingerprint_messages(messages):
+    return sha256(json_dumps(messages, sort_keys=True).encode()).hexdigest()[:16]
+
+def get_price(model: str, input_tokens: int, output_tokens: int | None = None) -> float | None:
     round_digits = 4
-    multiplier_input_ratio = 0.9 # Assume ~10% of the usage is output tokens
+    multiplier_input_ratio = 0.9 # Only used when the input/output split is unknown
     cost = None
+    if output_tokens is None:
+        tokens = input_tokens
+        input_tokens, output_tokens = tokens * multiplier_input_ratio, tokens * (1 - multiplier_input_ratio)
     # Mistral logic
     multiplier_euro_to_dollar = 1.1
     mistral_pricing_per_million = {
@@ -269,13 +661,13 @@ def get_price(model: str, tokens: int) -> float | None:
     'gpt-3.5-turbo-1106' : (0.001, 0.002),
     'gpt-3.5-turbo' : (0.003, 0.006)
     }
-    unadjusted_price = None
     if model in mistral_pricing_per_million:
-        unadjusted_price = tokens / 1000000 * mistral_pricing_per_million[model][0] * multiplier_euro_to_dollar
+        input_price, output_price = mistral_pricing_per_million[model]
+        cost = (input_tokens * input_price + output_tokens * output_price) / 1000000 * multiplier_euro_to_dollar
     elif model in openai_pricing_per_thousand:
-        unadjusted_price = tokens / 1000 * openai_pricing_per_thousand[model][0]
+        input_price, output_price = openai_pricing_per_thousand[model]
+        cost = (input_tokens * input_price + output_tokens * output_price) / 1000
     else:
-        print(f"Model {model} not found in pricing tables")
+        log(DEBUG, "Model %s not found in pricing tables", model)
         return None
-    cost = round(unadjusted_price * (1/multiplier_input_ratio), round_digits)
-    return cost
\ No newline at end of file
+    return round(cost, round_digits)
\ No newline at end of file
@@ -0,0 +1,84 @@
+import asyncio
+
+from microchain.engine.agent import Agent
+from microchain.tracing import get_tracer
+
+class AsyncAgent(Agent):
+    # Runs the same step and run loops as Agent (see Agent.perform), awaiting
+    # the LLM and the engine so many agents can share one event loop
+    async def acall_llm(self, messages):
+        with get_tracer().span("llm.call", messages=len(messages), candidates=self.candidates) as span:
+            if self.candidates > 1:
+                replies, tokens = await self.llm.acandidates(messages, self.candidates, **self.llm_kwargs())
+                reply = self.select_candidate(replies)
+            else:
+                reply, tokens = await self.llm.acall(messages, **self.llm_kwargs())
+            self.trace_usage(span, tokens)
+            return reply, tokens
+
+    async def aperform(self, request, payload):
+        if request == "llm":
+            return await self.acall_llm(payload)
+        if request == "execute":
+            return await self.engine.aexecute(payload)
+        if request == "execute_call":
+            return await self.engine.aexecute_call(payload.name, payload.arguments)
+        if request == "execute_plan":
+            return await self.engine.aexecute_plan(payload)
+        if request == "step":
+            return await self.astep()
+        if request == "flush":
+            return await self.flush_writes()
+
+    async def adrive(self, requests):
+        value, error = None, None
+        while True:
+            try:
+                request = requests.send(value) if error is None else requests.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            value, error = None, None
+            try:
+                value = await self.aperform(*request)
+            except Exception as e:
+                error = e
+
+    async def astep(self):
+        return await self.adrive(self.step_loop())
+
+    # Pending file write, see write_in_thread
+    pending_write = None
+
+    def write_in_thread(self, write, *args):
+        # Writes and fsyncs run in a thread so other sessions on the loop keep going;
+        # each write waits for the previous one so files land in order
+        previous = self.pending_write
+
+        async def chained():
+            if previous is not None:
+                await previous
+            await asyncio.to_thread(write, *args)
+
+        self.pending_write = asyncio.ensure_future(chained())
+
+    def write_checkpoint(self, data):
+        self.write_in_thread(self.checkpointer.write, data)
+
+    def save_file(self, data):
+        self.write_in_thread(super().save_file, data)
+
+    async def flush_writes(self):
+        if self.pending_write is not None:
+            write, self.pending_write = self.pending_write, None
+            await write
+
+    async def arun(self, resume=False):
+        try:
+            return await self.adrive(self.run_loop(resume))
+        finally:
+            # Also on errors, so no write is left running after arun returns
+            await self.flush_writes()
+
+    def run(self, resume=False):
+        # Thin sync wrapper so AsyncAgent can be used as a drop-in Agent
+        return asyncio.run(self.arun(resume))
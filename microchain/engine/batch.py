@@ -0,0 +1,104 @@
+import asyncio
+import threading
+from time import time, monotonic, sleep
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from microchain.engine.async_agent import AsyncAgent
+
+class RateLimiter:
+    def __init__(self, requests_per_minute):
+        if requests_per_minute <= 0:
+            raise ValueError("requests_per_minute must be positive")
+        self.interval = 60 / requests_per_minute
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # Claim the next free slot and return how long to wait for it
+        with self.lock:
+            now = monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        return start - now
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            sleep(wait)
+
+    async def aacquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+def provider_name(generator):
+    return getattr(generator, "provider", None) or getattr(generator, "model", None) or type(generator).__name__
+
+class BatchRunner:
+    def __init__(self, agent_factory, max_concurrency=8, rate_limits=None):
+        # agent_factory(prompt) -> Agent; rate_limits maps provider name to requests per minute
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.agent_factory = agent_factory
+        self.max_concurrency = max_concurrency
+        self.rate_limiters = {provider: RateLimiter(rpm) for provider, rpm in (rate_limits or {}).items()}
+
+    def build_agent(self, prompt):
+        agent = self.agent_factory(prompt)
+        limiter = self.rate_limiters.get(provider_name(agent.llm.generator))
+        if limiter is not None:
+            agent.llm.rate_limiter = limiter
+        return agent
+
+    def make_result(self, index, prompt, agent, answer, error, start_time):
+        return dict(
+            index=index,
+            prompt=prompt,
+            final_answer=answer,
+            finish_reason=agent.finish_reason if agent else None,
+            step_count=agent.step_count if agent else 0,
+            tokens=agent.total_tokens if agent else 0,
+            wall_time=round(time() - start_time, 4),
+            error=error,
+        )
+
+    def run_one(self, index, prompt):
+        start_time = time()
+        agent = None
+        answer = None
+        error = None
+        try:
+            agent = self.build_agent(prompt)
+            answer = agent.run()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        return self.make_result(index, prompt, agent, answer, error, start_time)
+
+    async def arun_one(self, index, prompt, semaphore):
+        async with semaphore:
+            start_time = time()
+            agent = None
+            answer = None
+            error = None
+            try:
+                agent = self.build_agent(prompt)
+                if isinstance(agent, AsyncAgent):
+                    answer = await agent.arun()
+                else:
+                    answer = await asyncio.to_thread(agent.run)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            return self.make_result(index, prompt, agent, answer, error, start_time)
+
+    def run(self, prompts):
+        # Yields one result dict per prompt, in completion order
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            futures = [pool.submit(self.run_one, index, prompt) for index, prompt in enumerate(prompts)]
+            for future in as_completed(futures):
+                yield future.result()
+
+    async def arun(self, prompts):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = [asyncio.ensure_future(self.arun_one(index, prompt, semaphore)) for index, prompt in enumerate(prompts)]
+        for task in asyncio.as_completed(tasks):
+            yield await task
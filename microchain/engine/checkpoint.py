@@ -0,0 +1,61 @@
+import os
+import json
+import pickle
+import base64
+
+CHECKPOINT_VERSION = 1
+
+class JSONStateSerializer:
+    def dumps(self, state):
+        return json.dumps(state)
+
+    def loads(self, data):
+        return json.loads(data)
+
+class PickleStateSerializer:
+    # For engine states holding objects JSON cannot encode; only load checkpoints you wrote
+    def dumps(self, state):
+        return base64.b64encode(pickle.dumps(state)).decode()
+
+    def loads(self, data):
+        return pickle.loads(base64.b64decode(data))
+
+class FileCheckpointer:
+    # Saves the agent every `every` steps to one JSON file, replaced atomically so a
+    # crash mid-write leaves the previous checkpoint intact.
+    def __init__(self, path, every=1, serializer=None):
+        self.path = path
+        self.every = every
+        self.serializer = serializer if serializer is not None else JSONStateSerializer()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def dumps(self, checkpoint):
+        # Serialize while the agent is not changing the checkpoint; write() may then run in a thread
+        return json.dumps(dict(checkpoint, engine_state=self.serializer.dumps(checkpoint["engine_state"])))
+
+    def save(self, checkpoint):
+        self.write(self.dumps(checkpoint))
+
+    def write(self, data):
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version {checkpoint.get('version')} in {self.path}")
+        checkpoint["engine_state"] = self.serializer.loads(checkpoint["engine_state"])
+        return checkpoint
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
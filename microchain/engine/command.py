@@ -0,0 +1,168 @@
+import ast
+import keyword
+import re
+from functools import lru_cache
+from microchain.engine.function import FunctionResult
+from microchain.engine.stream_parser import CommandStreamParser
+
+PARSE_CACHE_SIZE = 4096
+
+ARG_ERROR_MESSAGE = "Error: Failed function call. Instead, follow the function schema one step at a time."
+
+# Fast path for the common `Name(const, kw=const)` shape. Anything it does not
+# recognise (escapes, nested calls, comments, ...) falls back to ast.
+_NAME = r"[A-Za-z_][A-Za-z0-9_]*"
+_NUMBER = r"-?(?:(?:0|[1-9][0-9]*)\.[0-9]*|\.[0-9]+|0|[1-9][0-9]*)(?:[eE][+-]?[0-9]+)?"
+_STRING = r"\"[^\"\\\n]*\"|'[^'\\\n]*'"
+_VALUE = rf"{_NUMBER}|{_STRING}|True|False|None"
+_ARG = rf"(?:({_NAME})\s*=\s*)?({_VALUE})"
+FAST_COMMAND = re.compile(rf"({_NAME})\(\s*((?:{_ARG}\s*,\s*)*(?:{_ARG})?)\s*\)\s*")
+FAST_ARG = re.compile(rf"\s*{_ARG}\s*(?:,|$)")
+FAST_CONSTANTS = {"True": True, "False": False, "None": None}
+
+def fast_value(text):
+    if text in FAST_CONSTANTS:
+        return FAST_CONSTANTS[text]
+    if text[0] in "\"'":
+        return text[1:-1]
+    if any(char in text for char in ".eE"):
+        return float(text)
+    return int(text)
+
+def fast_parse(command):
+    match = FAST_COMMAND.fullmatch(command)
+    if match is None or keyword.iskeyword(match.group(1)):
+        return None
+    args = []
+    kwargs = {}
+    try:
+        for arg in FAST_ARG.finditer(match.group(2)):
+            name, value = arg.group(1), arg.group(2)
+            if name is None:
+                if kwargs:
+                    # positional after keyword is a syntax error, let ast report it
+                    return None
+                args.append(fast_value(value))
+            else:
+                # `class=1` is not valid Python either, ast reports both the same way
+                if name in kwargs or keyword.iskeyword(name):
+                    return None
+                kwargs[name] = fast_value(value)
+    except ValueError:
+        # int() refuses literals past sys.get_int_max_str_digits(), ast decides what that means
+        return None
+    return match.group(1), tuple(args), tuple(kwargs.items())
+
+def constant_value(node):
+    if isinstance(node, ast.Constant):
+        return True, node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) and isinstance(node.operand, ast.Constant):
+        return True, -node.operand.value
+    return False, None
+
+def ast_parse(command):
+    try:
+        tree = ast.parse(command)
+    except SyntaxError:
+        return FunctionResult.ERROR, f"Error: syntax error in command {command}. Please try again."
+
+    if len(tree.body) != 1 or not isinstance(tree.body[0], ast.Expr):
+        return FunctionResult.ERROR, f"Error: unknown command {command}. Please try again."
+
+    call = tree.body[0].value
+    if not isinstance(call, ast.Call) or not isinstance(call.func, ast.Name):
+        return FunctionResult.ERROR, f"Error: the command {command} must be a function call. Please try again."
+
+    args = []
+    for arg in call.args:
+        is_constant, value = constant_value(arg)
+        if not is_constant:
+            return FunctionResult.ERROR, ARG_ERROR_MESSAGE + ' Hint: function arg must be a constant.'
+        args.append(value)
+
+    kwargs = []
+    for kwarg in call.keywords:
+        is_constant, value = constant_value(kwarg.value)
+        if kwarg.arg is None or not is_constant:
+            return FunctionResult.ERROR, ARG_ERROR_MESSAGE + ' Hint: function kwarg must be a constant.'
+        kwargs.append((kwarg.arg, value))
+
+    return FunctionResult.SUCCESS, (call.func.id, tuple(args), tuple(kwargs))
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_command(command):
+    # Returns (FunctionResult.SUCCESS, (name, args, kwargs)) or (FunctionResult.ERROR, message).
+    # Only immutable constants can appear in a command, so results are safe to share.
+    parsed = fast_parse(command)
+    if parsed is not None:
+        return FunctionResult.SUCCESS, parsed
+    return ast_parse(command)
+
+NUMBER_TYPES = (int, float, complex)
+
+class ArgumentValidator:
+    # Built once per Function at Engine.register time
+    def __init__(self, function):
+        metadata = function.metadata or function.freeze()
+        self.names = list(metadata.annotations)
+        self.arity = metadata.arity
+        self.annotations = metadata.annotations
+        self.checks = {name: self.build_check(annotation) for name, annotation in self.annotations.items()}
+
+    @staticmethod
+    def build_check(annotation):
+        if annotation in NUMBER_TYPES:
+            # Numbers are interchangeable, the function decides how to coerce them
+            return lambda value: isinstance(value, NUMBER_TYPES)
+        if annotation is str:
+            return lambda value: isinstance(value, str)
+        if annotation is bool:
+            return lambda value: isinstance(value, (bool, int))
+        return None
+
+    def __call__(self, args, kwargs):
+        if len(args) + len(kwargs) != self.arity:
+            return False
+        seen = set(self.names[:len(args)])
+        for name, value in zip(self.names, args):
+            check = self.checks[name]
+            if check is not None and not check(value):
+                return False
+        for name, value in kwargs:
+            if name not in self.checks or name in seen:
+                return False
+            seen.add(name)
+            check = self.checks[name]
+            if check is not None and not check(value):
+                return False
+        return True
+
+PLAN_SEPARATORS = " \t\r\n;,"
+
+def split_commands(text, function_names):
+    # Splits a reply such as "Add(1, 2)\nMultiply(3, 4)" into its leading calls to
+    # registered functions, stopping at the first thing that is not one.
+    commands = []
+    rest = text
+    while True:
+        rest = rest.lstrip(PLAN_SEPARATORS)
+        if not rest:
+            break
+        parser = CommandStreamParser(function_names)
+        command = parser.feed(rest)
+        if command is None:
+            break
+        commands.append(command)
+        rest = rest[parser.position:]
+    return commands
+
+def plan_steps(command):
+    # PlanSteps(["Add(1, 2)", "Stop()"]) -> ["Add(1, 2)", "Stop()"], or None
+    try:
+        call = ast.parse(command).body[0].value
+        steps = ast.literal_eval(call.args[0] if call.args else call.keywords[0].value)
+    except (SyntaxError, ValueError, IndexError, AttributeError):
+        return None
+    if not isinstance(steps, list) or not all(isinstance(step, str) for step in steps):
+        return None
+    return steps
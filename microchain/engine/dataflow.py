@@ -0,0 +1,124 @@
+import re
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from microchain.engine.function import FunctionResult
+
+# `$N` outside of string literals refers to the output of the N-th command of the plan
+REFERENCE = re.compile(r"""("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')|\$(\d+)""")
+FUNCTION_NAME = re.compile(r"\s*([A-Za-z_][A-Za-z0-9_]*)\(")
+
+DATAFLOW_HELP = "Use $N as an argument to refer to the result of the N-th command of your reply, e.g. Add(1, 2) then Multiply($1, 3)."
+
+def references(command):
+    return {int(match.group(2)) for match in REFERENCE.finditer(command) if match.group(2)}
+
+def literal(output):
+    for cast in (int, float):
+        try:
+            return repr(cast(output))
+        except ValueError:
+            pass
+    return repr(output)
+
+def substitute(command, outputs):
+    return REFERENCE.sub(lambda match: match.group(1) or literal(outputs[int(match.group(2)) - 1]), command)
+
+def is_parallel_safe(engine, command):
+    match = FUNCTION_NAME.match(command)
+    function = engine.functions.get(match.group(1)) if match else None
+    return getattr(function, "parallel_safe", False)
+
+def build_dependencies(engine, commands):
+    # Returns one set of prerequisite indexes per command, or an error message.
+    # Commands that are not parallel_safe act as barriers: they wait for every
+    # earlier command and every later command waits for them.
+    dependencies = []
+    barrier = None
+    for index, command in enumerate(commands):
+        refs = {ref - 1 for ref in references(command)}
+        if any(ref < 0 or ref >= index for ref in refs):
+            dependencies.append(f"Error: {command} can only refer to earlier commands ($1 to ${index}). Please try again.")
+            continue
+        if is_parallel_safe(engine, command):
+            if barrier is not None:
+                refs.add(barrier)
+        else:
+            refs |= set(range(index))
+            barrier = index
+        dependencies.append(refs)
+    return dependencies
+
+class PlanSchedule:
+    # Tracks which commands of a dataflow plan are ready, running, done or failed
+    def __init__(self, engine, commands):
+        self.engine = engine
+        self.commands = commands
+        self.outcomes = [None] * len(commands)
+        self.outputs = [None] * len(commands)
+        self.dependencies = build_dependencies(engine, commands)
+        self.failed = set()
+        self.done = set()
+        self.pending = set()
+        for index, dependency in enumerate(self.dependencies):
+            if isinstance(dependency, str):
+                self.outcomes[index] = (commands[index], FunctionResult.ERROR, dependency)
+                self.failed.add(index)
+            else:
+                self.pending.add(index)
+
+    def ready(self):
+        # Yields (index, command) for every command whose prerequisites succeeded
+        for index in sorted(self.pending):
+            if self.dependencies[index] & self.failed or getattr(self.engine.agent, "do_stop", False):
+                self.pending.discard(index)
+                self.failed.add(index)
+            elif self.dependencies[index] <= self.done:
+                self.pending.discard(index)
+                yield index, substitute(self.commands[index], self.outputs)
+
+    def finish(self, index, command, result, output):
+        self.outcomes[index] = (command, result, output)
+        self.outputs[index] = output
+        if result == FunctionResult.ERROR:
+            self.failed.add(index)
+        else:
+            self.done.add(index)
+
+def execute_plan(engine, commands, max_workers):
+    # Returns [(command, result, output) or None if skipped] in plan order, with
+    # references replaced by the values they resolved to.
+    schedule = PlanSchedule(engine, commands)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="microchain-plan") as pool:
+        running = {}
+        while schedule.pending or running:
+            for index, command in schedule.ready():
+                # Copy the context so spans opened by the command keep their parent
+                running[pool.submit(contextvars.copy_context().run, engine.execute, command)] = (index, command)
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                schedule.finish(*running.pop(future), *future.result())
+    return schedule.outcomes
+
+async def aexecute_plan(engine, commands, max_workers):
+    # Same contract as execute_plan, with commands run as tasks on the current loop
+    schedule = PlanSchedule(engine, commands)
+    slots = asyncio.Semaphore(max_workers)
+
+    async def run(command):
+        async with slots:
+            return await engine.aexecute(command)
+
+    running = {}
+    while schedule.pending or running:
+        for index, command in schedule.ready():
+            running[asyncio.ensure_future(run(command))] = (index, command)
+        if not running:
+            break
+        finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in finished:
+            schedule.finish(*running.pop(task), *task.result())
+    return schedule.outcomes
@@ -1,16 +1,59 @@
-import ast
+from copy import copy, deepcopy
+
 from microchain.engine.function import Function, FunctionResult
+from microchain.engine.command import parse_command
+from microchain.engine.dataflow import execute_plan, aexecute_plan, DATAFLOW_HELP
+from microchain.engine.registry import Registry
+from microchain.engine.state import State
+from microchain.tracing import get_tracer
 
 class Engine:
-    def __init__(self, state: dict = dict()):
-        self.state = state
-        self.functions: dict[str, Function] = dict()
+    def __init__(self, state: dict | None = None, dataflow=False, max_workers=8, registry: Registry | None = None):
+        # Every engine gets its own state unless one is passed, see microchain.engine.state
+        self.state = state if state is not None else State()
+        # Plans may refer to earlier results with $N and independent calls run concurrently
+        self.dataflow = dataflow
+        self.max_workers = max_workers
+        # A shared registry is frozen; without one the engine owns a private registry
+        self.shared = registry is not None
+        self.registry = registry.freeze() if registry is not None else Registry()
+        self.functions = self.registry.functions
+        self.validators = self.registry.validators
+        # Functions bound to this engine's state, by name
+        self.bound: dict[str, Function] = dict()
         self.help_called = False
         self.agent = None
     
     def register(self, function: Function):
-        self.functions[function.name] = function
+        if self.shared:
+            raise ValueError("This engine uses a shared registry, register functions on a new Registry instead")
+        self.registry.register(function)
         function.bind(state=self.state, engine=self)
+        self.bound[function.name] = function
+
+    def function(self, name: str):
+        # Functions of a shared registry are copied and bound on first use, the copy
+        # shares the frozen metadata and the memoized results of pure functions
+        function = self.bound.get(name)
+        if function is None:
+            function = copy(self.functions[name])
+            function.bind(state=self.state, engine=self)
+            self.bound[name] = function
+        return function
+
+    def fork(self, state=None):
+        # Another engine for a parallel session: same registry (frozen from now on)
+        # and a copy-on-write snapshot of this engine's state
+        if state is None:
+            state = self.state.fork() if isinstance(self.state, State) else State(deepcopy(self.state))
+        engine = Engine(state=state, dataflow=self.dataflow, max_workers=self.max_workers, registry=self.registry)
+        # Prompts built from this engine's help are valid for the fork
+        engine.help_called = self.help_called
+        return engine
+
+    def state_dict(self):
+        # Plain dict of the state for checkpoints
+        return self.state.to_dict() if isinstance(self.state, State) else self.state
 
     def bind(self, agent):
         self.agent = agent
@@ -20,76 +63,137 @@ class Engine:
             raise ValueError("You must bind the engine to an agent before stopping")
         self.agent.stop()
 
-    def execute(self, command: str):
+    def validate(self, command: str):
+        # Parse and check a command without running it
+        result, parsed = parse_command(command)
+        if result == FunctionResult.ERROR:
+            return result, parsed
+
+        function_name, function_args, function_kwargs = parsed
+        if function_name not in self.functions:
+            return FunctionResult.ERROR, f"Error: unknown command {command}. Please try again."
+        
+        valid_function = self.function(function_name)
+        if not self.validators[function_name](function_args, function_kwargs):
+            return FunctionResult.ERROR, valid_function.error
+
+        return FunctionResult.SUCCESS, (valid_function, function_args, function_kwargs)
+
+    def check_ready(self):
         if self.agent is None:
             raise ValueError("You must bind the engine to an agent before executing commands")
         if not self.help_called:
             raise ValueError("You never accessed the help property. Building a prompt without including the help string is a very bad idea.")
-        try:
-            tree = ast.parse(command)
-        except SyntaxError:
-            return FunctionResult.ERROR, f"Error: syntax error in command {command}. Please try again."
-        
-        if len(tree.body) != 1:
-            return FunctionResult.ERROR, f"Error: unknown command {command}. Please try again."
 
-        if not isinstance(tree.body[0], ast.Expr):
-            return FunctionResult.ERROR, f"Error: unknown command {command}. Please try again."
+    def validate_call(self, name: str, arguments):
+        # Structured tool call from a provider: the arguments are already parsed
+        if name not in self.functions:
+            return FunctionResult.ERROR, f"Error: unknown function {name}. Please try again."
+        if not isinstance(arguments, dict):
+            return FunctionResult.ERROR, self.functions[name].error
+        function_kwargs = tuple(arguments.items())
+        if not self.validators[name]((), function_kwargs):
+            return FunctionResult.ERROR, self.functions[name].error
+        return FunctionResult.SUCCESS, (self.function(name), (), function_kwargs)
 
-        if not isinstance(tree.body[0].value, ast.Call):
-            return FunctionResult.ERROR, f"Error: the command {command} must be a function call. Please try again."
-        
-        if not isinstance(tree.body[0].value.func, ast.Name):
-            return FunctionResult.ERROR, f"Error: the command {command} must be a function call. Please try again."
-
-        function_name = tree.body[0].value.func.id
-        function_args = tree.body[0].value.args
-        function_kwargs = tree.body[0].value.keywords
-
-        # Check that all arguments are constants
-        ERROR_MESSAGE = f"Error: Failed function call. Instead, follow the function schema one step at a time."
-        for arg in function_args:
-            if not isinstance(arg, ast.Constant):
-                if isinstance(arg, ast.UnaryOp) and isinstance(arg.op, ast.USub) and isinstance(arg.operand, ast.Constant):
-                    continue
-                return FunctionResult.ERROR, ERROR_MESSAGE + ' Hint: function arg must be a constant.'
-
-        for kwarg in function_kwargs:
-            if not isinstance(kwarg, ast.keyword):
-                return FunctionResult.ERROR, ERROR_MESSAGE + ' Hint: function kwarg must be a keyword.'
-            if not isinstance(kwarg.value, ast.Constant):
-                if isinstance(kwarg.value, ast.UnaryOp) and isinstance(kwarg.value.op, ast.USub) and isinstance(kwarg.value.operand, ast.Constant):
-                    continue
-                return FunctionResult.ERROR, ERROR_MESSAGE + ' Hint: function kwarg must be a constant.'
-
-        # For function_args
-        function_args_values = []
-        for arg in function_args:
-            if isinstance(arg, ast.UnaryOp) and isinstance(arg.op, ast.USub):
-                function_args_values.append(-arg.operand.value)
-            else:
-                function_args_values.append(arg.value)
-        function_args = function_args_values
-
-        # For function_kwargs
-        function_kwargs_dict = {}
-        for kwarg in function_kwargs:
-            if isinstance(kwarg.value, ast.UnaryOp) and isinstance(kwarg.value.op, ast.USub):
-                function_kwargs_dict[kwarg.arg] = -kwarg.value.operand.value
-            else:
-                function_kwargs_dict[kwarg.arg] = kwarg.value.value
-        function_kwargs = function_kwargs_dict
+    def prepare(self, span, result, validated):
+        # Returns (error, None, None) or (None, validated, cached output or None)
+        if result == FunctionResult.ERROR:
+            span.set(result=result.name)
+            return (result, validated), None, None
+        valid_function, function_args, function_kwargs = validated
+        key, cached = valid_function.lookup(function_args, function_kwargs)
+        span.set(function=valid_function.name, cached=cached is not None)
+        return None, (valid_function, function_args, function_kwargs, key), cached
 
-        if function_name not in self.functions:
-            return FunctionResult.ERROR, f"Error: unknown command {command}. Please try again."
-        
-        if len(function_args_values) + len(function_kwargs_dict) != len(self.functions[function_name].call_parameters):
-            return FunctionResult.ERROR, self.functions[function_name].error
-        
-        valid_function = self.functions[function_name]
-        return valid_function.safe_call(args=function_args_values, kwargs=function_kwargs_dict)   
+    def call(self, tracer, span, checked):
+        error, validated, cached = self.prepare(span, *checked)
+        if error is not None:
+            return error
+        if cached is not None:
+            return FunctionResult.SUCCESS, cached
+
+        valid_function, function_args, function_kwargs, key = validated
+        with tracer.span("function.call", function=valid_function.name):
+            outcome = valid_function.safe_call(args=list(function_args), kwargs=dict(function_kwargs))
+        span.set(result=outcome[0].name)
+        return valid_function.remember(key, outcome)
+
+    async def acall(self, tracer, span, checked):
+        error, validated, cached = self.prepare(span, *checked)
+        if error is not None:
+            return error
+        if cached is not None:
+            return FunctionResult.SUCCESS, cached
+
+        valid_function, function_args, function_kwargs, key = validated
+        with tracer.span("function.call", function=valid_function.name):
+            outcome = await valid_function.safe_acall(args=list(function_args), kwargs=dict(function_kwargs))
+        span.set(result=outcome[0].name)
+        return valid_function.remember(key, outcome)
+
+    def execute(self, command: str):
+        self.check_ready()
+        tracer = get_tracer()
+        with tracer.span("engine.execute", command=command) as span:
+            with tracer.span("engine.validate"):
+                checked = self.validate(command)
+            return self.call(tracer, span, checked)
+
+    async def aexecute(self, command: str):
+        # Awaits async functions and keeps blocking ones off the event loop
+        self.check_ready()
+        tracer = get_tracer()
+        with tracer.span("engine.execute", command=command) as span:
+            with tracer.span("engine.validate"):
+                checked = self.validate(command)
+            return await self.acall(tracer, span, checked)
+
+    def execute_call(self, name: str, arguments):
+        self.check_ready()
+        tracer = get_tracer()
+        with tracer.span("engine.execute", command=name, tool_call=True) as span:
+            return self.call(tracer, span, self.validate_call(name, arguments))
+
+    async def aexecute_call(self, name: str, arguments):
+        self.check_ready()
+        tracer = get_tracer()
+        with tracer.span("engine.execute", command=name, tool_call=True) as span:
+            return await self.acall(tracer, span, self.validate_call(name, arguments))
     
+    def execute_plan(self, commands: list[str]):
+        return execute_plan(self, commands, self.max_workers)
+
+    async def aexecute_plan(self, commands: list[str]):
+        return await aexecute_plan(self, commands, self.max_workers)
+
+    def cache_stats(self):
+        return {
+            name: dict(hits=function.hits, misses=function.misses)
+            for name, function in self.bound.items() if function.pure
+        }
+
+    def grammar(self, mode="gbnf", multiple=False):
+        return self.registry.grammar(mode, multiple, references=self.dataflow and multiple)
+
+    def tools(self, names=None):
+        # OpenAI-style tool schemas; they replace the help text in the prompt.
+        # `names` restricts them to a subset, e.g. the one picked by a ToolSelector.
+        self.help_called = True
+        if names is None:
+            return self.registry.tools()
+        names = set(names)
+        return [tool for tool in self.registry.tools() if tool["function"]["name"] in names]
+
+    def help_for(self, names):
+        # Help of a subset of the functions; every registered function still executes
+        self.help_called = True
+        text = "\n".join([self.functions[name].help for name in names if name in self.functions])
+        if self.dataflow:
+            text += "\n" + DATAFLOW_HELP + "\n"
+        return text
+
     @property
     def help(self):
         self.help_called = True
-        return "\n".join([f.help for f in self.functions.values()])
+        return self.registry.help(self.dataflow)
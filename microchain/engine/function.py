@@ -1,13 +1,80 @@
 import enum
+import asyncio
 import inspect
-import traceback
-from termcolor import colored
+import threading
+import concurrent.futures
+from functools import partial
+
+from microchain.models.cache import MemoryResponseStore
+from microchain.log import log, WARNING
+
+TIMEOUTS = (TimeoutError, asyncio.TimeoutError, concurrent.futures.TimeoutError)
+JSON_TYPES = {int: "integer", float: "number", str: "string", bool: "boolean", list: "array", dict: "object"}
+
+worker_lock = threading.Lock()
+workers = None
+
+def worker_pool():
+    # Shared by every Function so blocking tools cannot pile up unbounded threads
+    global workers
+    with worker_lock:
+        if workers is None:
+            workers = concurrent.futures.ThreadPoolExecutor(max_workers=16, thread_name_prefix="microchain-function")
+        return workers
+
+loop_lock = threading.Lock()
+loop = None
+
+def background_loop():
+    # Sync callers run async functions here. One long-lived loop, so clients bound
+    # to a loop (httpx.AsyncClient, database pools) keep working from call to call
+    global loop
+    with loop_lock:
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="microchain-loop", daemon=True).start()
+        return loop
+
+def in_event_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
 
 class FunctionResult(enum.Enum):
     SUCCESS = 0
     ERROR = 1
 
+class FunctionMetadata:
+    __slots__ = ("name", "signature", "example", "help", "error", "arity", "annotations", "tool")
+
+    def __init__(self, *, name, signature, example, help, error, arity, annotations, tool):
+        self.name = name
+        self.signature = signature
+        self.example = example
+        self.help = help
+        self.error = error
+        self.arity = arity
+        self.annotations = annotations
+        self.tool = tool
+
 class Function:
+    __slots__ = ("call_signature", "call_parameters", "state", "engine", "metadata", "is_async", "results", "hits", "misses")
+    # Set to True on functions that can run concurrently with others in a dataflow plan
+    parallel_safe = False
+    # Seconds before a call is abandoned and reported to the model as an error
+    timeout = None
+    # Set to True on sync functions doing I/O so async agents run them in the worker pool
+    blocking = False
+    # Set to True on functions whose output only depends on their arguments so
+    # Engine.execute can reuse earlier results
+    pure = False
+    cache_size = 1024
+    cache_ttl = None
+    # Any response store (e.g. a SQLiteResponseStore) to share results across functions and processes
+    cache_store = None
+
     def __init__(self):
         self.call_signature = inspect.signature(self.__call__)        
         self.call_parameters = []
@@ -21,17 +88,41 @@ class Function:
             ))
         self.state = None
         self.engine = None
+        self.metadata = None
+        self.is_async = inspect.iscoroutinefunction(self.__call__)
+        self.results = None
+        self.hits = 0
+        self.misses = 0
     
     def bind(self, *, state, engine):
         self.state = state
         self.engine = engine
 
+    def freeze(self):
+        # Render every derived string once; called by Engine.register
+        self.metadata = None
+        signature = self.build_signature()
+        example = self.build_example()
+        help = f"{signature}\n{self.description}.\nExample: {example}\n"
+        self.metadata = FunctionMetadata(
+            name=self.name,
+            signature=signature,
+            example=example,
+            help=help,
+            error=f"Error: wrong format. Use {signature}. Example: {example}. Please try again.",
+            arity=len(self.call_parameters),
+            annotations={parameter["name"]: parameter["annotation"] for parameter in self.call_parameters},
+            tool=self.build_tool(),
+        )
+        if self.pure and self.results is None:
+            self.results = self.cache_store if self.cache_store is not None else MemoryResponseStore(self.cache_size, self.cache_ttl)
+        return self.metadata
+
     @property
     def name(self):
         return type(self).__name__
 
-    @property
-    def example(self):
+    def build_example(self):
         if not isinstance(self.example_args, list):
             raise ValueError("example_args must be a list")
         if len(self.example_args) != len(self.call_parameters):
@@ -40,32 +131,132 @@ class Function:
         bound = self.call_signature.bind(*self.example_args)
         
         return f"{self.name}({', '.join([f'{name}={value}' for name, value in bound.arguments.items()])})"
+
+    def build_tool(self):
+        properties = dict()
+        for parameter in self.call_parameters:
+            json_type = JSON_TYPES.get(parameter["annotation"])
+            properties[parameter["name"]] = dict(type=json_type) if json_type else dict()
+        return dict(
+            type="function",
+            function=dict(
+                name=self.name,
+                description=self.description,
+                parameters=dict(
+                    type="object",
+                    properties=properties,
+                    required=[parameter["name"] for parameter in self.call_parameters],
+                ),
+            ),
+        )
+
+    def build_signature(self):
+        arguments = [f"{parameter['name']}: {parameter['annotation'].__name__}" for parameter in self.call_parameters]
+        return f"{self.name}({', '.join(arguments)})"
+
+    @property
+    def example(self):
+        if self.metadata is not None:
+            return self.metadata.example
+        return self.build_example()
     
     @property
     def signature(self):
-        arguments = [f"{parameter['name']}: {parameter['annotation'].__name__}" for parameter in self.call_parameters]
-        return f"{self.name}({', '.join(arguments)})"
+        if self.metadata is not None:
+            return self.metadata.signature
+        return self.build_signature()
+
+    @property
+    def tool(self):
+        if self.metadata is not None:
+            return self.metadata.tool
+        return self.build_tool()
 
     @property
     def help(self):
+        if self.metadata is not None:
+            return self.metadata.help
         return f"{self.signature}\n{self.description}.\nExample: {self.example}\n"
 
     @property
     def error(self):
+        if self.metadata is not None:
+            return self.metadata.error
         return f"Error: wrong format. Use {self.signature}. Example: {self.example}. Please try again."
 
     def check_bind(self):
         if self.state is None:
             raise ValueError("You must register the function to an Engine")
 
+    def cache_key(self, args, kwargs):
+        # Bind first so Add(1, 2) and Add(a=1, b=2) share an entry
+        bound = self.call_signature.bind(*args, **dict(kwargs))
+        return repr((self.name, tuple(bound.arguments.items())))
+
+    def lookup(self, args, kwargs):
+        # Returns (key, cached output or None); key is None for functions that are not memoized
+        if self.results is None:
+            return None, None
+        key = self.cache_key(args, kwargs)
+        entry = self.results.get(key)
+        if entry is None:
+            self.misses += 1
+            return key, None
+        self.hits += 1
+        return key, entry["output"]
+
+    def remember(self, key, outcome):
+        # Errors are never cached so a failing call is retried
+        if key is not None and outcome[0] == FunctionResult.SUCCESS:
+            self.results.put(key, outcome[1])
+        return outcome
+
+    def call(self, args, kwargs):
+        if self.is_async:
+            coroutine = asyncio.wait_for(self.__call__(*args, **kwargs), self.timeout)
+            if in_event_loop() and asyncio.get_running_loop() is background_loop():
+                # Sync code running on the background loop itself cannot wait on it
+                return worker_pool().submit(asyncio.run, coroutine).result()
+            return asyncio.run_coroutine_threadsafe(coroutine, background_loop()).result()
+        if self.timeout is None:
+            return self.__call__(*args, **kwargs)
+        # A sync call cannot be interrupted, it is abandoned in the worker pool
+        return worker_pool().submit(self.__call__, *args, **kwargs).result(self.timeout)
+
+    async def acall(self, args, kwargs):
+        if self.is_async:
+            call = self.__call__(*args, **kwargs)
+        elif self.blocking or self.timeout is not None:
+            call = asyncio.get_running_loop().run_in_executor(worker_pool(), partial(self.__call__, *args, **kwargs))
+        else:
+            return self.__call__(*args, **kwargs)
+        return await asyncio.wait_for(call, self.timeout)
+
     def safe_call(self, args, kwargs):
         self.check_bind()
         try:
-            return FunctionResult.SUCCESS, str(self.__call__(*args, **kwargs))
+            return FunctionResult.SUCCESS, str(self.call(args, kwargs))
+        except TIMEOUTS:
+            return self.timed_out()
+        except Exception as e:
+            return self.failed(e)
+
+    async def safe_acall(self, args, kwargs):
+        self.check_bind()
+        try:
+            return FunctionResult.SUCCESS, str(await self.acall(args, kwargs))
+        except TIMEOUTS:
+            return self.timed_out()
         except Exception as e:
-            print(colored(f"Exception in Function call {e}", "red"))
-            print(colored(''.join(traceback.TracebackException.from_exception(e).format()), "red"))
-            return FunctionResult.ERROR, self.error
+            return self.failed(e)
+
+    def timed_out(self):
+        log(WARNING, "Function %s timed out after %ss", self.name, self.timeout, color="red")
+        return FunctionResult.ERROR, f"Error: {self.name} timed out after {self.timeout}s. Please try again."
+
+    def failed(self, e):
+        log(WARNING, "Exception in Function call %s", e, color="red", exc_info=e)
+        return FunctionResult.ERROR, self.error
 
     def __call__(self, command):
         raise NotImplementedError
@@ -0,0 +1,80 @@
+import re
+
+from microchain.engine.command import NUMBER_TYPES
+
+# Constrain a local model to emit only calls to registered functions, positional
+# arguments typed like their annotations. "gbnf" is the llama.cpp `grammar` format,
+# "regex" the vLLM `guided_regex` one.
+GRAMMAR_MODES = ("gbnf", "regex")
+
+GBNF_VALUES = r'''
+ws ::= [ ]?
+int ::= "-"? [0-9]+
+number ::= "-"? [0-9]+ ("." [0-9]+)?
+string ::= "\"" ([^"\\\n] | "\\" ["\\nt])* "\""
+bool ::= "True" | "False"
+list ::= "[" ws (value ws ("," ws value ws)*)? "]"
+value ::= number | string | bool | list
+'''.strip()
+
+REGEX_VALUES = dict(
+    int=r"-?\d+",
+    number=r"-?\d+(\.\d+)?",
+    string=r'"([^"\\\n]|\\["\\nt])*"',
+    bool=r"(True|False)",
+    list=r"\[[^\]\n]*\]",
+)
+REGEX_VALUES["value"] = "(" + "|".join(REGEX_VALUES.values()) + ")"
+# Dataflow plans may pass $N instead of a value
+REFERENCE_VALUE = dict(gbnf='"$" [0-9]+', regex=r"\$\d+")
+
+def value_rule(annotation):
+    if annotation is bool:
+        return "bool"
+    if annotation is int:
+        return "int"
+    if annotation in NUMBER_TYPES:
+        return "number"
+    if annotation is str:
+        return "string"
+    if annotation is list:
+        return "list"
+    return "value"
+
+def rule_name(function_name):
+    return "call-" + re.sub(r"[^a-z0-9]+", "-", function_name.lower())
+
+def gbnf_call(function, references):
+    arguments = []
+    for annotation in function.metadata.annotations.values():
+        rule = value_rule(annotation)
+        arguments.append(f"({rule} | {REFERENCE_VALUE['gbnf']})" if references else rule)
+    name = f'"{function.name}("'
+    if not arguments:
+        return f'{name} ")"'
+    return f'{name} ws ' + ' ws "," ws '.join(arguments) + ' ws ")"'
+
+def build_gbnf(functions, multiple=False, references=False):
+    calls = {rule_name(function.name): gbnf_call(function, references) for function in functions}
+    lines = ["root ::= call (\"\\n\" call)*" if multiple else "root ::= call"]
+    lines.append("call ::= " + " | ".join(calls))
+    lines += [f"{name} ::= {body}" for name, body in calls.items()]
+    lines.append(GBNF_VALUES)
+    return "\n".join(lines) + "\n"
+
+def regex_call(function, references):
+    arguments = []
+    for annotation in function.metadata.annotations.values():
+        pattern = REGEX_VALUES[value_rule(annotation)]
+        arguments.append(f"({pattern}|{REFERENCE_VALUE['regex']})" if references else pattern)
+    return re.escape(function.name) + r"\( ?" + r" ?, ?".join(arguments) + r" ?\)"
+
+def build_regex(functions, multiple=False, references=False):
+    call = "(" + "|".join(regex_call(function, references) for function in functions) + ")"
+    return f"{call}(\\n{call})*" if multiple else call
+
+def build_grammar(functions, mode, multiple=False, references=False):
+    if mode not in GRAMMAR_MODES:
+        raise ValueError(f"grammar must be one of {GRAMMAR_MODES}")
+    builder = build_gbnf if mode == "gbnf" else build_regex
+    return builder(functions, multiple, references)
@@ -0,0 +1,105 @@
+from microchain.models.tokenizer import HEURISTIC_COUNTER, message_text
+
+def estimate_tokens(messages):
+    return HEURISTIC_COUNTER.count_messages(messages)
+
+def split_turns(messages):
+    # A turn is an assistant message followed by the replies it produced
+    turns = []
+    for message in messages:
+        if message["role"] == "assistant" or not turns:
+            turns.append([message])
+        else:
+            turns[-1].append(message)
+    return turns
+
+def join_turns(turns):
+    return [message for turn in turns for message in turn]
+
+def turn_output(turn):
+    return " ".join(str(message["content"]) for message in turn[1:])
+
+def turn_command(turn):
+    calls = turn[0].get("tool_calls")
+    if calls:
+        return " ".join(f"{call['function']['name']}({call['function']['arguments']})" for call in calls)
+    return message_text(turn[0])
+
+class HistoryPolicy:
+    # Policies receive the full history, the number of leading messages that must be
+    # kept verbatim (system message, bootstrap and prompt) and a token counter, and
+    # return the messages to send. They never modify the stored history.
+    # Policies with `retries = True` also trim the failed tries within a step.
+    retries = False
+
+    def __call__(self, messages, head_length, count_tokens=estimate_tokens):
+        head, turns = messages[:head_length], split_turns(messages[head_length:])
+        return head + join_turns(self.apply(head, turns, count_tokens))
+
+    def apply(self, head, turns, count_tokens):
+        raise NotImplementedError
+
+class CollapseReasoning(HistoryPolicy):
+    # Keep only the last of consecutive Reasoning(...) turns
+    def apply(self, head, turns, count_tokens):
+        kept = []
+        for turn in turns:
+            if kept and is_reasoning(kept[-1]) and is_reasoning(turn):
+                kept[-1] = turn
+            else:
+                kept.append(turn)
+        return kept
+
+def is_reasoning(turn):
+    return turn_command(turn).startswith("Reasoning(")
+
+class DropErrors(HistoryPolicy):
+    # Drop turns whose output was an error once a later turn has moved past them.
+    # Failed tries never reach the history, so this mostly acts on the retries of
+    # the current step: the model sees its latest error, not every earlier one.
+    retries = True
+
+    def apply(self, head, turns, count_tokens):
+        return [turn for index, turn in enumerate(turns)
+                if index == len(turns) - 1 or not turn_output(turn).startswith("Error")]
+
+class SlidingWindow(HistoryPolicy):
+    def __init__(self, max_turns=None, max_tokens=None):
+        if max_turns is None and max_tokens is None:
+            raise ValueError("SlidingWindow needs max_turns or max_tokens")
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+
+    def apply(self, head, turns, count_tokens):
+        if self.max_turns is not None:
+            turns = turns[-self.max_turns:] if self.max_turns > 0 else []
+        if self.max_tokens is not None:
+            budget = self.max_tokens - count_tokens(head)
+            kept = []
+            for turn in reversed(turns):
+                budget -= count_tokens(turn)
+                if budget < 0:
+                    break
+                kept.append(turn)
+            turns = kept[::-1]
+        return turns
+
+def summarize_turns(turns):
+    return "\n".join(f"{turn_command(turn)} -> {turn_output(turn)}" for turn in turns)
+
+class Summarize(HistoryPolicy):
+    # Fold every turn except the last `keep_turns` into the prompt message.
+    # `summarizer(turns) -> str` can be swapped for an LLM-backed one.
+    def __init__(self, keep_turns=6, summarizer=summarize_turns):
+        self.keep_turns = keep_turns
+        self.summarizer = summarizer
+
+    def __call__(self, messages, head_length, count_tokens=estimate_tokens):
+        head, turns = messages[:head_length], split_turns(messages[head_length:])
+        if len(turns) <= self.keep_turns:
+            return messages
+        old_turns, turns = turns[:len(turns) - self.keep_turns], turns[len(turns) - self.keep_turns:]
+        summary = self.summarizer(old_turns)
+        # Merge into the prompt so user/assistant roles keep alternating
+        prompt = dict(head[-1], content=f"{head[-1]['content']}\n\nSummary of earlier steps:\n{summary}")
+        return head[:-1] + [prompt] + join_turns(turns)
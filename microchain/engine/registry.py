@@ -0,0 +1,53 @@
+from microchain.engine.function import Function
+from microchain.engine.command import ArgumentValidator
+from microchain.engine.dataflow import DATAFLOW_HELP
+from microchain.engine.grammar import build_grammar
+
+class Registry:
+    # Function definitions and everything derived from them: validators, help text,
+    # tool schemas and grammars, each built once. Engine(registry=...) freezes it so
+    # any number of engines can share it; each engine binds its own shallow copy of
+    # a function the first time it executes it.
+    def __init__(self, functions=()):
+        self.functions: dict[str, Function] = dict()
+        self.validators: dict[str, ArgumentValidator] = dict()
+        self.frozen = False
+        self.help_cache = dict()
+        self.grammar_cache = dict()
+        self.tools_cache = None
+        for function in functions:
+            self.register(function)
+
+    def register(self, function: Function):
+        if self.frozen:
+            raise ValueError("This registry is shared by several engines, build a new Registry to add functions")
+        function.freeze()
+        self.functions[function.name] = function
+        self.validators[function.name] = ArgumentValidator(function)
+        self.help_cache = dict()
+        self.grammar_cache = dict()
+        self.tools_cache = None
+
+    def freeze(self):
+        self.frozen = True
+        return self
+
+    def help(self, dataflow=False):
+        if dataflow not in self.help_cache:
+            text = "\n".join([f.help for f in self.functions.values()])
+            if dataflow:
+                text += "\n" + DATAFLOW_HELP + "\n"
+            self.help_cache[dataflow] = text
+        return self.help_cache[dataflow]
+
+    def grammar(self, mode, multiple=False, references=False):
+        # Compiled once per registered function set, see microchain.engine.grammar
+        key = (mode, multiple, references)
+        if key not in self.grammar_cache:
+            self.grammar_cache[key] = build_grammar(self.functions.values(), mode, multiple, references)
+        return self.grammar_cache[key]
+
+    def tools(self):
+        if self.tools_cache is None:
+            self.tools_cache = [f.tool for f in self.functions.values()]
+        return self.tools_cache
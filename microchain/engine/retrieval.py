@@ -0,0 +1,76 @@
+import re
+import math
+from collections import Counter, defaultdict
+
+WORD = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+def tokenize(text):
+    # "PlaceMark(row: int)" -> ["place", "mark", "row", "int"], single characters carry no signal
+    return [word.lower() for word in WORD.findall(text) if len(word) > 1]
+
+def normalize(vector):
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+class ToolIndex:
+    # Ranks functions by relevance to a query. BM25 over name, description and
+    # parameter names by default; with `embedder` (texts -> vectors) cosine
+    # similarity against vectors computed once when the index is built.
+    def __init__(self, functions, embedder=None, k1=1.5, b=0.75):
+        functions = list(functions)
+        self.names = [function.name for function in functions]
+        documents = [self.document(function) for function in functions]
+        terms = [Counter(tokenize(document)) for document in documents]
+        lengths = [sum(counts.values()) for counts in terms]
+        average_length = sum(lengths) / len(lengths) if lengths else 1.0
+        frequencies = Counter(term for counts in terms for term in counts)
+        # Term weights are precomputed, a search only sums the postings of the query terms
+        self.postings = defaultdict(list)
+        for index, counts in enumerate(terms):
+            for term, count in counts.items():
+                idf = math.log(1 + (len(documents) - frequencies[term] + 0.5) / (frequencies[term] + 0.5))
+                weight = idf * count * (k1 + 1) / (count + k1 * (1 - b + b * lengths[index] / average_length))
+                self.postings[term].append((index, weight))
+        self.embedder = embedder
+        self.vectors = [normalize(vector) for vector in embedder(documents)] if embedder is not None else None
+
+    @classmethod
+    def from_engine(cls, engine, **kwargs):
+        return cls(engine.functions.values(), **kwargs)
+
+    @staticmethod
+    def document(function):
+        parameters = " ".join(parameter["name"] for parameter in function.call_parameters)
+        return f"{function.name} {function.description} {parameters}"
+
+    def scores(self, query):
+        if self.vectors is not None:
+            query_vector = normalize(self.embedder([query])[0])
+            return {index: sum(a * b for a, b in zip(query_vector, vector)) for index, vector in enumerate(self.vectors)}
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            for index, weight in self.postings.get(term, ()):
+                scores[index] += weight
+        return scores
+
+    def search(self, query, k):
+        scores = self.scores(query)
+        ranked = sorted(scores, key=lambda index: (-scores[index], index))
+        return [self.names[index] for index in ranked[:k] if scores[index] > 0]
+
+class ToolSelector:
+    # Picks the functions shown to the model: `always` plus the top k matches for
+    # the prompt (per_step=False) or for the prompt and the latest turn (per_step=True).
+    # The engine still executes any registered function.
+    def __init__(self, index, k=8, always=("Reasoning", "Stop"), per_step=False):
+        self.index = index
+        self.k = k
+        self.always = list(always)
+        self.per_step = per_step
+
+    def __call__(self, query):
+        names = list(self.always)
+        for name in self.index.search(query, self.k):
+            if name not in names:
+                names.append(name)
+        return names
@@ -0,0 +1,244 @@
+import os
+import gzip
+import json
+import queue
+import atexit
+import shutil
+import sqlite3
+import threading
+from contextlib import closing
+from time import time, time_ns, strftime
+from uuid import uuid4
+
+from microchain.log import log, ERROR
+
+def new_run_id():
+    # Sorts by start time and stays unique across threads and processes
+    return f"{strftime('%Y%m%d-%H%M%S')}-{uuid4().hex[:8]}"
+
+class RunStore:
+    # Agents only enqueue records; a single background thread batches them to disk,
+    # so persistence never blocks a step or the event loop.
+    def __init__(self):
+        self.records = queue.SimpleQueue()
+        self.closed = False
+        self.writer = threading.Thread(target=self.drain, name="microchain-run-store", daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def start_run(self, run_id, config, messages):
+        self.records.put(dict(type="start", run=run_id, time=time(), config=config))
+        for message in messages:
+            self.append(run_id, message)
+
+    def append(self, run_id, message):
+        # Whole message, so native tool calls keep tool_calls and tool_call_id
+        self.records.put(dict(message, type="message", run=run_id))
+
+    def finish_run(self, run_id, summary):
+        self.records.put(dict(type="finish", run=run_id, time=time(), summary=summary))
+
+    def drain(self):
+        running = True
+        while running:
+            batch = [self.records.get()]
+            while True:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            flushed = [record for record in batch if isinstance(record, threading.Event)]
+            running = None not in batch
+            records = [record for record in batch if isinstance(record, dict)]
+            try:
+                if records:
+                    self.write(records)
+            except Exception as e:
+                log(ERROR, "Run store failed to write %s records: %s", len(records), e, color="red")
+            for event in flushed:
+                event.set()
+        self.release()
+
+    def flush(self):
+        # Blocks until everything queued so far is written
+        if self.closed:
+            return
+        event = threading.Event()
+        self.records.put(event)
+        event.wait()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.records.put(None)
+        self.writer.join()
+
+    def write(self, records):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+    def runs(self):
+        # [dict(run, started, finished, config, summary)] oldest first
+        raise NotImplementedError
+
+    def load(self, run_id):
+        # Same shape as the history files in sample-history: [run entry] + messages
+        raise NotImplementedError
+
+class JSONLRunStore(RunStore):
+    # Appends to <directory>/runs.jsonl. Past max_bytes the file is renamed,
+    # gzipped and only the newest `keep` archives are kept.
+    def __init__(self, directory="logs", max_bytes=50 * 1024 * 1024, keep=10, compress=True):
+        self.directory = directory
+        self.path = os.path.join(directory, "runs.jsonl")
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.compress = compress
+        self.file = None
+        os.makedirs(directory, exist_ok=True)
+        super().__init__()
+
+    def write(self, records):
+        if self.file is None:
+            self.file = open(self.path, "a")
+        self.file.write("".join(json.dumps(record, default=str) + "\n" for record in records))
+        self.file.flush()
+        if self.max_bytes is not None and self.file.tell() > self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        self.file = None
+        # Nanosecond names keep archives in write order, run ids only sort to the second
+        archive = os.path.join(self.directory, f"runs-{time_ns():020d}.jsonl")
+        os.replace(self.path, archive)
+        if self.compress:
+            with open(archive, "rb") as source, gzip.open(archive + ".gz", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.remove(archive)
+        if self.keep is not None:
+            archives = self.archives()
+            for old in archives[:max(0, len(archives) - self.keep)]:
+                os.remove(old)
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def archives(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.startswith("runs-"))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def read(self):
+        self.flush()
+        for path in self.archives() + [self.path]:
+            if not os.path.exists(path):
+                continue
+            with (gzip.open(path, "rt") if path.endswith(".gz") else open(path)) as f:
+                for line in f:
+                    yield json.loads(line)
+
+    def runs(self):
+        runs = {}
+        for record in self.read():
+            if record["type"] == "start":
+                runs[record["run"]] = dict(run=record["run"], started=record["time"], finished=None, config=record["config"], summary=None)
+            elif record["type"] == "finish":
+                # The start record may have been rotated out with an old archive
+                entry = runs.setdefault(record["run"], dict(run=record["run"], started=None, finished=None, config=None, summary=None))
+                entry.update(finished=record["time"], summary=record["summary"])
+        return list(runs.values())
+
+    def load(self, run_id):
+        entry = None
+        messages = []
+        for record in self.read():
+            if record["run"] != run_id:
+                continue
+            if record["type"] == "message":
+                messages.append({key: value for key, value in record.items() if key not in ("type", "run")})
+            else:
+                entry = record.get("summary") or record.get("config")
+        return [entry] + messages
+
+class SQLiteRunStore(RunStore):
+    # One row per run and per message; with max_runs only the newest runs are kept
+    def __init__(self, path="logs/runs.db", max_runs=None):
+        self.path = path
+        self.max_runs = max_runs
+        self.connection = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(sqlite3.connect(path)) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                "id TEXT PRIMARY KEY, started REAL, finished REAL, config TEXT, summary TEXT)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY, run TEXT, role TEXT, content TEXT, extra TEXT)"
+            )
+            # Databases written before native tool calls were recorded lack `extra`
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(messages)")]
+            if "extra" not in columns:
+                connection.execute("ALTER TABLE messages ADD COLUMN extra TEXT")
+            connection.execute("CREATE INDEX IF NOT EXISTS messages_run ON messages (run)")
+        super().__init__()
+
+    def write(self, records):
+        if self.connection is None:
+            # Owned by the writer thread
+            self.connection = sqlite3.connect(self.path)
+        with self.connection:
+            for record in records:
+                if record["type"] == "start":
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO runs (id, started, config) VALUES (?, ?, ?)",
+                        (record["run"], record["time"], json.dumps(record["config"], default=str))
+                    )
+                elif record["type"] == "message":
+                    # tool_calls / tool_call_id of native tool calls
+                    extra = {key: value for key, value in record.items() if key not in ("type", "run", "role", "content")}
+                    self.connection.execute(
+                        "INSERT INTO messages (run, role, content, extra) VALUES (?, ?, ?, ?)",
+                        (record["run"], record["role"], record["content"], json.dumps(extra) if extra else None)
+                    )
+                else:
+                    self.connection.execute(
+                        "UPDATE runs SET finished = ?, summary = ? WHERE id = ?",
+                        (record["time"], json.dumps(record["summary"], default=str), record["run"])
+                    )
+            if self.max_runs is not None:
+                self.connection.execute(
+                    "DELETE FROM runs WHERE id NOT IN (SELECT id FROM runs ORDER BY started DESC LIMIT ?)",
+                    (self.max_runs,)
+                )
+                self.connection.execute("DELETE FROM messages WHERE run NOT IN (SELECT id FROM runs)")
+
+    def release(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def query(self, sql, parameters=()):
+        self.flush()
+        with closing(sqlite3.connect(self.path)) as connection:
+            return connection.execute(sql, parameters).fetchall()
+
+    def runs(self):
+        return [
+            dict(run=run, started=started, finished=finished, config=json.loads(config), summary=json.loads(summary) if summary else None)
+            for run, started, finished, config, summary in self.query("SELECT id, started, finished, config, summary FROM runs ORDER BY started")
+        ]
+
+    def load(self, run_id):
+        rows = self.query("SELECT config, summary FROM runs WHERE id = ?", (run_id,))
+        entry = json.loads(rows[0][1] or rows[0][0]) if rows else None
+        messages = self.query("SELECT role, content, extra FROM messages WHERE run = ? ORDER BY id", (run_id,))
+        return [entry] + [dict(role=role, content=content, **(json.loads(extra) if extra else {})) for role, content, extra in messages]
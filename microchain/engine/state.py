@@ -0,0 +1,99 @@
+import threading
+from copy import deepcopy
+from collections.abc import MutableMapping
+
+# Values that can be shared between snapshots as they are
+IMMUTABLE_TYPES = (str, bytes, int, float, complex, bool, type(None), frozenset, range)
+EMPTY = dict()
+
+class State(MutableMapping):
+    # Engine state with copy-on-write snapshots. fork() is O(1) once the state is
+    # frozen: the fork shares every value and deep-copies a mutable one (a board,
+    # a list) only when it first reads it, so a prepared state can seed thousands
+    # of sessions without copying what they never touch.
+    # Keys in `shared` are never copied: API clients, locks and connections cannot
+    # be deep-copied and should be one object for every fork anyway. In-place
+    # changes to a shared value are seen by all snapshots.
+    def __init__(self, data=None, shared=()):
+        # base is never mutated once it is shared, writes go to local
+        self.base = EMPTY
+        self.local = dict(data or ())
+        self.deleted = set()
+        self.shared = frozenset(shared)
+        self.lock = threading.Lock()
+
+    def __getitem__(self, key):
+        if key in self.local:
+            return self.local[key]
+        if key in self.deleted or key not in self.base:
+            raise KeyError(key)
+        value = self.base[key]
+        if isinstance(value, IMMUTABLE_TYPES) or key in self.shared:
+            return value
+        # Copy on first access so in-place changes stay in this snapshot
+        with self.lock:
+            if key not in self.local:
+                try:
+                    self.local[key] = deepcopy(value)
+                except TypeError as e:
+                    raise TypeError(f"State value {key!r} cannot be copied into a fork, list it in State(shared=...)") from e
+            return self.local[key]
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.local[key] = value
+            self.deleted.discard(key)
+
+    def __delitem__(self, key):
+        with self.lock:
+            if key not in self:
+                raise KeyError(key)
+            self.local.pop(key, None)
+            if key in self.base:
+                self.deleted.add(key)
+
+    def __contains__(self, key):
+        return key in self.local or (key in self.base and key not in self.deleted)
+
+    def __iter__(self):
+        yield from self.local
+        for key in self.base:
+            if key not in self.local and key not in self.deleted:
+                yield key
+
+    def __len__(self):
+        return len(self.local) + sum(1 for key in self.base if key not in self.local and key not in self.deleted)
+
+    def __repr__(self):
+        return f"State({self.to_dict()!r})"
+
+    def __reduce__(self):
+        return State, (self.to_dict(), self.shared)
+
+    def clear(self):
+        with self.lock:
+            self.base = EMPTY
+            self.local = dict()
+            self.deleted = set()
+
+    def to_dict(self):
+        # Plain dict for serializers; values are not copied
+        data = {key: value for key, value in self.base.items() if key not in self.deleted}
+        data.update(self.local)
+        return data
+
+    def freeze(self):
+        # Fold the local changes into a new shared base; the lock keeps a write in
+        # another thread from landing in a local dict that is being dropped
+        with self.lock:
+            if self.local or self.deleted:
+                self.base = self.to_dict()
+                self.local = dict()
+                self.deleted = set()
+            return self.base
+
+    def fork(self):
+        # A snapshot of the current state; later writes to either side stay private
+        state = State(shared=self.shared)
+        state.base = self.freeze()
+        return state
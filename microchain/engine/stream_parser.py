@@ -0,0 +1,71 @@
+class CommandStreamParser:
+    # Incrementally scans a streamed reply and reports the first complete
+    # `Name(...)` call to one of the registered functions.
+    def __init__(self, function_names):
+        self.function_names = set(function_names)
+        self.reset()
+
+    def reset(self):
+        self.text = ""
+        self.position = 0
+        self.start = None
+        self.name = None
+        self.depth = 0
+        self.quote = None
+        self.escape = False
+        self.command = None
+        self.failed = False
+
+    @property
+    def done(self):
+        return self.command is not None or self.failed
+
+    def feed(self, chunk):
+        if self.done:
+            return self.command
+        self.text += chunk
+        while self.position < len(self.text) and not self.done:
+            self.scan(self.text[self.position])
+            self.position += 1
+        return self.command
+
+    def scan(self, char):
+        if self.start is None:
+            if char.isspace():
+                return
+            if not (char.isalpha() or char == "_"):
+                self.failed = True
+                return
+            self.start = self.position
+            return
+
+        if self.name is None:
+            if char.isalnum() or char == "_":
+                return
+            if char != "(":
+                self.failed = True
+                return
+            self.name = self.text[self.start:self.position]
+            if self.name not in self.function_names:
+                self.failed = True
+                return
+            self.depth = 1
+            return
+
+        if self.quote is not None:
+            if self.escape:
+                self.escape = False
+            elif char == "\\":
+                self.escape = True
+            elif char == self.quote:
+                self.quote = None
+            return
+
+        if char in ("'", '"'):
+            self.quote = char
+        elif char == "(":
+            self.depth += 1
+        elif char == ")":
+            self.depth -= 1
+            if self.depth == 0:
+                self.command = self.text[self.start:self.position + 1]
@@ -1,6 +1,9 @@
 from microchain import Function
+from microchain.log import log, DEBUG
 
 class Reasoning(Function):
+    parallel_safe = True
+
     @property
     def description(self):
         return "Use this function for your internal reasoning. It should be immediately followed by a function call."
@@ -32,9 +35,9 @@ class PlanSteps(Function):
 
     @property
     def example_args(self):
-        return [["Add(3, 4)", "Power(7, 2)", 'Reasoning("Final answer: 625")', "Stop()]"]]
+        return [["Add(3, 4)", "Power(7, 2)", 'Reasoning("Final answer: 625")', "Stop()"]]
 
     def __call__(self, steps: str):
-        print('Called PlanSteps')
+        log(DEBUG, 'Called PlanSteps')
         return steps
         # return f"Planned steps have a syntax issue. Try again, following strictly to the function schema."
\ No newline at end of file
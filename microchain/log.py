@@ -0,0 +1,60 @@
+import sys
+import queue
+import atexit
+import logging
+from logging import DEBUG, INFO, WARNING, ERROR
+from logging.handlers import QueueHandler, QueueListener
+from termcolor import colored
+
+logger = logging.getLogger("microchain")
+listener = None
+
+class ColorFormatter(logging.Formatter):
+    # Only runs for records that are emitted, so colors and tracebacks cost nothing when filtered
+    def format(self, record):
+        message = super().format(record)
+        color = getattr(record, "color", None)
+        return colored(message, color) if color else message
+
+class DeferredQueueHandler(QueueHandler):
+    # The stdlib QueueHandler renders the message on the calling thread, leave that to the sink
+    def prepare(self, record):
+        return record
+
+def console_handler(stream=None):
+    handler = logging.StreamHandler(stream if stream is not None else sys.stdout)
+    handler.setFormatter(ColorFormatter("%(message)s"))
+    return handler
+
+def stop_sink():
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+def configure_logging(level=INFO, async_sink=False, stream=None, handler=None):
+    # level=WARNING or ERROR is the quiet mode for batch runs. With async_sink=True
+    # records are queued and rendered on a background thread.
+    global listener
+    stop_sink()
+    for existing in list(logger.handlers):
+        logger.removeHandler(existing)
+    handler = handler if handler is not None else console_handler(stream)
+    if async_sink:
+        records = queue.SimpleQueue()
+        listener = QueueListener(records, handler)
+        listener.start()
+        handler = DeferredQueueHandler(records)
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    # Keep the console output of scripts; applications can attach their own handlers instead
+    logger.propagate = False
+
+def log(level, message, *args, color=None, exc_info=None):
+    # Pass values as args (%s) so nothing is formatted when the level is disabled
+    if logger.isEnabledFor(level):
+        logger.log(level, message, *args, extra=dict(color=color), exc_info=exc_info, stacklevel=2)
+
+# A library only silences its logger; scripts call configure_logging() for console output
+logger.addHandler(logging.NullHandler())
+atexit.register(stop_sink)
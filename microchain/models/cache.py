@@ -0,0 +1,172 @@
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from hashlib import sha256
+from time import time
+
+from microchain.models.generator import GeneratorWrapper, TokenUsage, ToolCall, ToolReply
+
+CACHE_MODES = ("read_write", "record", "replay")
+
+class CacheMiss(Exception):
+    pass
+
+def cache_key(generator, messages, stop=None):
+    payload = dict(
+        model=getattr(generator, "model", None),
+        messages=messages,
+        temperature=getattr(generator, "temperature", None),
+        top_p=getattr(generator, "top_p", None),
+        max_tokens=getattr(generator, "max_tokens", None),
+        stop=stop,
+    )
+    return sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+def reply_fields(output):
+    # A ToolReply reads as its calls in text form, keep the calls themselves next to the usage
+    if getattr(output, "tool_calls", None) is None:
+        return dict()
+    calls = [dict(name=call.name, arguments=call.arguments, id=call.id) for call in output.tool_calls]
+    return dict(tool_calls=calls, content=output.content)
+
+def restore_reply(output, usage):
+    if usage and usage.get("tool_calls") is not None:
+        return ToolReply([ToolCall(**call) for call in usage["tool_calls"]], content=usage.get("content"))
+    return output
+
+class MemoryResponseStore:
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl is not None and time() - entry["created"] > self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, output, usage=None):
+        with self.lock:
+            self.entries[key] = dict(output=output, usage=usage, created=time())
+            self.entries.move_to_end(key)
+            while self.max_entries is not None and len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+class SQLiteResponseStore:
+    def __init__(self, path, max_entries=None, ttl=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, output TEXT, usage TEXT, created REAL, last_used REAL)"
+        )
+        self.connection.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT output, usage, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            output, usage, created = row
+            if self.ttl is not None and time() - created > self.ttl:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.connection.commit()
+                return None
+            self.connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time(), key))
+            self.connection.commit()
+            return dict(output=output, usage=json.loads(usage), created=created)
+
+    def put(self, key, output, usage=None):
+        now = time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, output, usage, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, output, json.dumps(usage), now, now)
+            )
+            if self.max_entries is not None:
+                self.connection.execute(
+                    "DELETE FROM responses WHERE key NOT IN (SELECT key FROM responses ORDER BY last_used DESC LIMIT ?)",
+                    (self.max_entries,)
+                )
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+class CachedGenerator(GeneratorWrapper):
+    # mode="read_write": serve hits, call and store on miss
+    # mode="record": always call the generator and overwrite the stored response
+    # mode="replay": never call the generator, raise CacheMiss on miss
+    def __init__(self, generator, store=None, mode="read_write", deterministic_only=True):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"mode must be one of {CACHE_MODES}")
+        self.generator = generator
+        self.store = store if store is not None else MemoryResponseStore()
+        self.mode = mode
+        # Sampling at temperature > 0 is not reproducible, so only replay reads those
+        self.deterministic_only = deterministic_only
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+
+    wrapped_field = "generator"
+
+    def primary(self):
+        return self.generator
+
+    def cacheable(self):
+        if self.mode == "replay" or not self.deterministic_only:
+            return True
+        return not getattr(self.generator, "temperature", 0)
+
+    def lookup(self, key):
+        if self.mode == "record" or not self.cacheable():
+            return None
+        entry = self.store.get(key)
+        if entry is None:
+            self.misses += 1
+            if self.mode == "replay":
+                raise CacheMiss(f"No recorded response for request {key[:16]}")
+            return None
+        self.hits += 1
+        self.saved_tokens += entry["usage"]["total"]
+        return restore_reply(entry["output"], entry["usage"]), TokenUsage(0)
+
+    def save(self, key, result):
+        if not isinstance(result, tuple) or not self.cacheable():
+            # Generators report some failures as a bare string, never cache those
+            return result
+        output, tokens = result
+        self.store.put(key, str(output), dict(
+            total=int(tokens),
+            prompt=getattr(tokens, "prompt_tokens", 0),
+            completion=getattr(tokens, "completion_tokens", 0),
+            **reply_fields(output),
+        ))
+        return result
+
+    def __call__(self, messages, stop=None, **kwargs):
+        key = cache_key(self.generator, messages, stop)
+        cached = self.lookup(key)
+        if cached is not None:
+            return cached
+        return self.save(key, self.generator(messages, stop=stop, **kwargs))
+
+    async def acall(self, messages, stop=None, **kwargs):
+        key = cache_key(self.generator, messages, stop)
+        cached = self.lookup(key)
+        if cached is not None:
+            return cached
+        return self.save(key, await self.generator.acall(messages, stop=stop, **kwargs))
@@ -1,6 +1,161 @@
+import json
+import asyncio
+from copy import copy
+from concurrent.futures import ThreadPoolExecutor
 from abc import ABC, abstractmethod
+from time import time
+from uuid import uuid4
+from email.utils import parsedate_to_datetime
+
+from microchain.models.tokenizer import approximate_tokens
+from microchain.tracing import current_span
+from microchain.log import log, DEBUG
+
+class GeneratorError(Exception):
+    # Raised by generators when the provider call fails. `retryable` marks timeouts,
+    # connection errors, 429 and 5xx; `retry_after` is the server's hint in seconds.
+    def __init__(self, message, retryable=True, retry_after=None, status=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.status = status
+
+RETRYABLE_STATUS = (408, 409, 429)
+
+def is_retryable_status(status):
+    return status is None or status in RETRYABLE_STATUS or status >= 500
+
+def parse_retry_after(headers):
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+        except (TypeError, ValueError):
+            return None
+
+def provider_error(error, status=None, headers=None):
+    # GeneratorError for a failed SDK call, no status means a timeout or connection error
+    return GeneratorError(
+        f"{type(error).__name__}: {error}",
+        retryable=is_retryable_status(status),
+        retry_after=parse_retry_after(headers),
+        status=status,
+    )
+
+class TokenUsage(int):
+    # Behaves like the total token count so `(output, tokens)` callers keep
+    # working, while carrying the prompt/completion/cached breakdown.
+    def __new__(cls, total=None, *, prompt_tokens=0, completion_tokens=0, cached_tokens=0):
+        if total is None:
+            total = prompt_tokens + completion_tokens
+        usage = super().__new__(cls, total)
+        usage.prompt_tokens = prompt_tokens
+        usage.completion_tokens = completion_tokens
+        usage.cached_tokens = cached_tokens
+        return usage
+
+class ToolCall:
+    __slots__ = ("id", "name", "arguments", "content")
+
+    def __init__(self, name, arguments, id=None, content=None):
+        # Tool results must refer to their call, make one up for servers that send no id
+        self.id = id or f"call_{uuid4().hex[:24]}"
+        self.name = name
+        # dict of keyword arguments, or None when the provider sent invalid JSON
+        self.arguments = arguments
+        # Text the model sent along with the call, see ToolReply
+        self.content = content
+
+    @property
+    def command(self):
+        # Text form for logs and history, the engine dispatches the structured arguments
+        if not isinstance(self.arguments, dict):
+            return f"{self.name}(...)"
+        return f"{self.name}({', '.join(f'{name}={value!r}' for name, value in self.arguments.items())})"
+
+    def messages(self, output):
+        # The call and its result in the OpenAI tool-calling format
+        arguments = self.arguments if isinstance(self.arguments, dict) else {}
+        return [
+            dict(role="assistant", content=self.content, tool_calls=[dict(
+                id=self.id,
+                type="function",
+                function=dict(name=self.name, arguments=json.dumps(arguments)),
+            )]),
+            dict(role="tool", tool_call_id=self.id, content=output),
+        ]
+
+class ToolReply(str):
+    # Reply made of native tool calls. Reads as the calls in text form, one per
+    # line, so code expecting a string reply keeps working.
+    def __new__(cls, tool_calls, content=None):
+        reply = super().__new__(cls, "\n".join(call.command for call in tool_calls))
+        reply.tool_calls = tool_calls
+        reply.content = content
+        if content and tool_calls and tool_calls[0].content is None:
+            # The text goes back to the model with the first call's assistant message
+            tool_calls[0].content = content
+        return reply
+
+def text_messages(messages):
+    # Tool turns as plain text for generators without tool calling, e.g. after
+    # ResilientGenerator fails over from an OpenAI-compatible server to Mistral
+    flattened = []
+    for message in messages:
+        if message.get("tool_calls"):
+            commands = [
+                ToolCall(call["function"]["name"], parse_tool_arguments(call["function"]["arguments"])).command
+                for call in message["tool_calls"]
+            ]
+            content = "\n".join(([message["content"]] if message.get("content") else []) + commands)
+            flattened.append(dict(role="assistant", content=content))
+        elif message["role"] == "tool":
+            flattened.append(dict(role="user", content=message["content"]))
+        else:
+            flattened.append(dict(role=message["role"], content=message["content"] or ""))
+    return flattened
+
+def parse_tool_arguments(arguments):
+    try:
+        arguments = json.loads(arguments or "{}")
+    except ValueError:
+        return None
+    return arguments if isinstance(arguments, dict) else None
+
+def sum_usage(usages):
+    if all(hasattr(usage, "prompt_tokens") for usage in usages):
+        return TokenUsage(
+            sum(usages),
+            prompt_tokens=sum(usage.prompt_tokens for usage in usages),
+            completion_tokens=sum(usage.completion_tokens for usage in usages),
+            cached_tokens=sum(usage.cached_tokens for usage in usages),
+        )
+    return sum(usages)
+
+def fresh_kwargs(kwargs):
+    # Stream parsers are stateful, every concurrent call needs its own
+    parser = kwargs.get("command_parser")
+    if parser is None:
+        return kwargs
+    parser = copy(parser)
+    parser.reset()
+    return dict(kwargs, command_parser=parser)
 
 class Generator(ABC):
+    provider = None
+
     @abstractmethod
     def __init__(self, model, api_key, temperature, top_p, max_tokens, *args, **kwargs):
         pass
@@ -8,3 +163,111 @@ class Generator(ABC):
     @abstractmethod
     def __call__(self, messages, *args, **kwargs):
         pass
+
+    async def acall(self, messages, *args, **kwargs):
+        # Fallback for blocking generators: run them off the event loop
+        return await asyncio.to_thread(self, messages, *args, **kwargs)
+
+    def candidates(self, messages, n, **kwargs):
+        # Returns ([output, ...], tokens) for n samples. The default fans out n
+        # concurrent calls; providers with an `n` parameter override this.
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            results = list(pool.map(lambda _: self(messages, **fresh_kwargs(kwargs)), range(n)))
+        return [output for output, _ in results], sum_usage([tokens for _, tokens in results])
+
+    async def acandidates(self, messages, n, **kwargs):
+        results = await asyncio.gather(*(self.acall(messages, **fresh_kwargs(kwargs)) for _ in range(n)))
+        return [output for output, _ in results], sum_usage([tokens for _, tokens in results])
+
+    def finish_stream(self, messages, collector):
+        self.last_stream_stats = collector.stats
+        current_span().set(**self.last_stream_stats)
+        total_tokens = collector.tokens(messages)
+        log(DEBUG, 'Used ~%s tokens (streamed, %s)', total_tokens, self.last_stream_stats)
+        return collector.output, total_tokens
+
+    def collect_stream(self, stream, messages, command_parser=None):
+        # Reads chat completion chunks until the parser has a complete command
+        collector = StreamCollector(command_parser)
+        try:
+            for chunk in stream:
+                if chunk.choices and collector.feed(chunk.choices[0].delta.content):
+                    break
+        finally:
+            stream.close()
+        return self.finish_stream(messages, collector)
+
+    async def acollect_stream(self, stream, messages, command_parser=None):
+        collector = StreamCollector(command_parser)
+        try:
+            async for chunk in stream:
+                if chunk.choices and collector.feed(chunk.choices[0].delta.content):
+                    break
+        finally:
+            # openai's AsyncStream has close(), Mistral streams are async generators
+            await (stream.aclose() if hasattr(stream, "aclose") else stream.close())
+        return self.finish_stream(messages, collector)
+
+class GeneratorWrapper(Generator):
+    # Base for generators that wrap others (CachedGenerator, ResilientGenerator).
+    # Attributes the wrapper does not set itself (model, max_tokens, stream,
+    # tool_calling...) come from primary().
+    wrapped_field = None
+
+    def primary(self):
+        raise NotImplementedError
+
+    def __getattr__(self, name):
+        # Only reached for missing attributes; the wrapped field itself is missing
+        # before __init__ has run (copy, pickle), never delegate that one
+        if name == self.wrapped_field or name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.primary(), name)
+
+    @property
+    def provider(self):
+        # Generator.provider is a class attribute, so __getattr__ never sees it
+        return self.primary().provider
+
+class StreamCollector:
+    def __init__(self, command_parser=None):
+        self.command_parser = command_parser
+        self.start_time = time()
+        self.first_token_time = None
+        self.command_time = None
+        self.chunks = []
+
+    def feed(self, content):
+        # Returns True once the stream can be closed
+        if not content:
+            return False
+        if self.first_token_time is None:
+            self.first_token_time = time()
+        self.chunks.append(content)
+        if self.command_parser is not None and self.command_parser.feed(content) is not None:
+            self.command_time = time()
+            return True
+        return False
+
+    @property
+    def output(self):
+        if self.command_time is not None:
+            return self.command_parser.command
+        return "".join(self.chunks)
+
+    @property
+    def stats(self):
+        return dict(
+            time_to_first_token=round(self.first_token_time - self.start_time, 4) if self.first_token_time else None,
+            time_to_command=round(self.command_time - self.start_time, 4) if self.command_time else None,
+            total_time=round(time() - self.start_time, 4),
+            cut_off=self.command_time is not None,
+        )
+
+    def tokens(self, messages):
+        # Streaming responses carry no usage block, so estimate both sides
+        prompt = messages if isinstance(messages, str) else "".join(str(message["content"]) for message in messages)
+        return TokenUsage(
+            prompt_tokens=approximate_tokens(prompt),
+            completion_tokens=approximate_tokens("".join(self.chunks)),
+        )
@@ -1,13 +1,41 @@
+from microchain.tracing import get_tracer
+
 class LLM:
-    def __init__(self, *, generator, templates=[]):
+    def __init__(self, *, generator, templates=[], rate_limiter=None):
         if not isinstance(templates, list):
             templates = [templates]
         
         self.generator = generator
         self.templates = templates
+        self.rate_limiter = rate_limiter
     
-    def __call__(self, prompt, stop=None):
+    def apply_templates(self, prompt):
         for template in self.templates:
             prompt = template(prompt)
+        return prompt
+
+    def acquire(self):
+        if self.rate_limiter is not None:
+            with get_tracer().span("llm.queue"):
+                self.rate_limiter.acquire()
+
+    async def aacquire(self):
+        if self.rate_limiter is not None:
+            with get_tracer().span("llm.queue"):
+                await self.rate_limiter.aacquire()
+
+    def __call__(self, prompt, stop=None, **kwargs):
+        self.acquire()
+        return self.generator(self.apply_templates(prompt), stop=stop, **kwargs)
+
+    async def acall(self, prompt, stop=None, **kwargs):
+        await self.aacquire()
+        return await self.generator.acall(self.apply_templates(prompt), stop=stop, **kwargs)
+
+    def candidates(self, prompt, n, stop=None, **kwargs):
+        self.acquire()
+        return self.generator.candidates(self.apply_templates(prompt), n, stop=stop, **kwargs)
 
-        return self.generator(prompt, stop=stop)
\ No newline at end of file
+    async def acandidates(self, prompt, n, stop=None, **kwargs):
+        await self.aacquire()
+        return await self.generator.acandidates(self.apply_templates(prompt), n, stop=stop, **kwargs)
\ No newline at end of file
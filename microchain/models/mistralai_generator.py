@@ -1,34 +1,81 @@
-from microchain.models.generator import Generator
-from mistralai.models.chat_completion import ChatMessage
-from termcolor import colored
+from microchain.models.generator import Generator, TokenUsage, provider_error, text_messages
+from microchain.models.transport import get_default_transport
+from microchain.log import log, DEBUG, ERROR
 try:
     from mistralai.client import MistralClient
+    from mistralai.async_client import MistralAsyncClient
+    from mistralai.client_base import ClientBase
+    from mistralai.constants import ENDPOINT
+    from mistralai.models.chat_completion import ChatMessage
+    from mistralai.exceptions import MistralException, MistralAPIException
 except ImportError:
     raise ImportError("Please install mistral using pip install mistralai")
 
+def generator_error(error):
+    if isinstance(error, MistralAPIException):
+        return provider_error(error, error.http_status, {key.lower(): value for key, value in error.headers.items()})
+    # MistralConnectionException and timeouts
+    return provider_error(error)
+
+class SharedMistralClient(MistralClient):
+    # MistralClient builds (and on __del__ closes) its own httpx client, use the shared pool instead.
+    # Its retry loop is off: ResilientGenerator owns backoff and Retry-After handling.
+    def __init__(self, *, http_client, max_retries=0, **kwargs):
+        super().__init__(max_retries=max_retries, **kwargs)
+        self._client.close()
+        self._client = http_client
+
+    def __del__(self):
+        pass
+
+class SharedMistralAsyncClient(MistralAsyncClient):
+    # MistralAsyncClient.__init__ would build an httpx.AsyncClient that can only be closed
+    # by awaiting it, so skip it and set up the base client around the shared pool
+    def __init__(self, *, http_client, api_key, endpoint=ENDPOINT, max_retries=0, timeout=120):
+        ClientBase.__init__(self, endpoint, api_key, max_retries, timeout)
+        self._client = http_client
+
+    async def close(self):
+        # The pool belongs to the Transport
+        pass
+
 class MistralChatGenerator(Generator):
-    def __init__(self, *, model, api_key, temperature=0.3, top_p=1, max_tokens=512):
+    provider = "mistral"
+
+    def __init__(self, *, model, api_key, temperature=0.3, top_p=1, max_tokens=512, stream=False, transport=None):
         self.model = model
         self.api_key = api_key
         self.temperature = temperature
         self.top_p = top_p
         self.max_tokens = max_tokens
-        self.client = MistralClient(api_key=self.api_key)
+        self.stream = stream
+        self.last_stream_stats = None
+        # Connections are pooled in a Transport shared by every generator in the process
+        self.transport = transport or get_default_transport()
+        self.client = SharedMistralClient(api_key=self.api_key, http_client=self.transport.client_for(ENDPOINT))
 
-    def __call__(self, context, stop=None):
+    def request_kwargs(self, context):
         message_history = None
         if type(context) != str:
-            print(f'{len(context)} messages in API call.')
-            message_history = [ChatMessage(role=message["role"], content=message["content"]) for message in context]
-        chat_response = self.client.chat(
-        model=self.model,
-        messages=message_history or [ChatMessage(role="user", content=context)],
-        temperature=self.temperature,   
-        max_tokens=self.max_tokens,
-        top_p=self.top_p,
+            log(DEBUG, '%s messages in API call.', len(context))
+            # No tool calling here, tool turns from another generator go in as text
+            message_history = [ChatMessage(role=message["role"], content=message["content"]) for message in text_messages(context)]
+        return dict(
+            model=self.model,
+            messages=message_history or [ChatMessage(role="user", content=context)],
+            temperature=self.temperature,   
+            max_tokens=self.max_tokens,
+            top_p=self.top_p,
+        )
+
+    def parse_response(self, chat_response, stop=None):
+        usage = chat_response.usage
+        total_tokens = TokenUsage(
+            usage.total_tokens or 0,
+            prompt_tokens=usage.prompt_tokens or 0,
+            completion_tokens=usage.completion_tokens or 0,
         )
-        total_tokens = chat_response.usage.total_tokens or 0
-        print(f'Used {total_tokens} tokens')
+        log(DEBUG, 'Used %s tokens', total_tokens)
         output = chat_response.choices[0].message.content.strip()
 
         if stop == ['\n']:
@@ -37,3 +84,48 @@ class MistralChatGenerator(Generator):
             # output = output.split('\n')[0]
             pass
         return output, total_tokens
+
+    def finish_stream(self, context, collector):
+        # Stripped like a complete response, see parse_response
+        output, total_tokens = super().finish_stream(context, collector)
+        return output.strip(), total_tokens
+
+    def stream_response(self, context, command_parser=None):
+        return self.collect_stream(self.client.chat_stream(**self.request_kwargs(context)), context, command_parser)
+
+    def __call__(self, context, stop=None, command_parser=None, **options):
+        # cache_key and grammar only apply to OpenAI-compatible servers, e.g. when
+        # ResilientGenerator fails over from a local server to Mistral
+        try:
+            if self.stream:
+                return self.stream_response(context, command_parser)
+            chat_response = self.client.chat(**self.request_kwargs(context))
+        except MistralException as e:
+            log(ERROR, "Error: %s", e, color="red")
+            raise generator_error(e) from e
+        return self.parse_response(chat_response, stop=stop)
+
+class AsyncMistralChatGenerator(MistralChatGenerator):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.async_client = None
+
+    def get_async_client(self):
+        # The transport hands out one pool per event loop, rebuild the client if the loop changed
+        http_client = self.transport.async_client_for(ENDPOINT)
+        if self.async_client is None or self.async_client._client is not http_client:
+            self.async_client = SharedMistralAsyncClient(api_key=self.api_key, http_client=http_client)
+        return self.async_client
+
+    async def astream_response(self, context, command_parser=None):
+        return await self.acollect_stream(self.get_async_client().chat_stream(**self.request_kwargs(context)), context, command_parser)
+
+    async def acall(self, context, stop=None, command_parser=None, **options):
+        try:
+            if self.stream:
+                return await self.astream_response(context, command_parser)
+            chat_response = await self.get_async_client().chat(**self.request_kwargs(context))
+        except MistralException as e:
+            log(ERROR, "Error: %s", e, color="red")
+            raise generator_error(e) from e
+        return self.parse_response(chat_response, stop=stop)
@@ -0,0 +1,131 @@
+import re
+import ast
+import json
+import random
+import operator
+import asyncio
+from time import sleep
+
+from microchain.models.generator import Generator, StreamCollector, TokenUsage
+from microchain.models.tokenizer import approximate_tokens
+
+EXPRESSION = re.compile(r"`([^`]+)`")
+OPERATIONS = {ast.Add: "Add", ast.Sub: "Subtract", ast.Mult: "Multiply", ast.Pow: "Power"}
+OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Pow: operator.pow}
+
+def load_transcript(path):
+    # Assistant replies of a history file (sample-history/ or logs/), in order
+    with open(path) as f:
+        data = json.load(f)
+    return [message["content"] for message in data if isinstance(message, dict) and message.get("role") == "assistant"]
+
+class MockGenerator(Generator):
+    # Offline generator with artificial latency: every call sleeps latency +/- jitter
+    # seconds. `seed` makes the jitter reproducible. With stream=True the reply is
+    # fed to the agent's command parser in small chunks, like a provider stream.
+    provider = "mock"
+    chunk_size = 4
+
+    def __init__(self, model="mock", latency=0.0, jitter=0.0, seed=0, max_tokens=512, stream=False):
+        self.model = model
+        self.stream = stream
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.max_tokens = max_tokens
+        self.temperature = 0
+        self.calls = 0
+
+    def delay(self):
+        if not self.latency and not self.jitter:
+            return 0
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def reply(self, messages):
+        raise NotImplementedError
+
+    def respond(self, messages, command_parser=None):
+        self.calls += 1
+        output = self.reply(messages)
+        if self.stream:
+            collector = StreamCollector(command_parser)
+            for start in range(0, len(output), self.chunk_size):
+                if collector.feed(output[start:start + self.chunk_size]):
+                    break
+            return collector.output, collector.tokens(messages)
+        prompt = "".join(str(message["content"]) for message in messages)
+        return output, TokenUsage(prompt_tokens=approximate_tokens(prompt), completion_tokens=approximate_tokens(output))
+
+    def __call__(self, messages, stop=None, command_parser=None, **kwargs):
+        delay = self.delay()
+        if delay:
+            sleep(delay)
+        return self.respond(messages, command_parser)
+
+    async def acall(self, messages, stop=None, command_parser=None, **kwargs):
+        delay = self.delay()
+        if delay:
+            await asyncio.sleep(delay)
+        return self.respond(messages, command_parser)
+
+class ScriptedGenerator(MockGenerator):
+    # Replays replies in order and then keeps answering `final`. Keep one instance
+    # per agent: the position is shared by every caller.
+    def __init__(self, replies, final="Stop()", **kwargs):
+        super().__init__(**kwargs)
+        self.replies = list(replies)
+        self.final = final
+        self.position = 0
+
+    @classmethod
+    def from_history(cls, path, skip=0, **kwargs):
+        # skip: assistant messages that came from the bootstrap, not from the model
+        return cls(load_transcript(path)[skip:], **kwargs)
+
+    def reply(self, messages):
+        if self.position >= len(self.replies):
+            return self.final
+        self.position += 1
+        return self.replies[self.position - 1]
+
+class CalcOracleGenerator(MockGenerator):
+    # Solves the `expression` in the prompt one binary operation at a time
+    # (Add/Subtract/Multiply/Power as in examples/calc.py) and then calls Stop().
+    # It is stateless, so one instance can serve any number of sessions.
+    def __init__(self, operations=None, **kwargs):
+        super().__init__(**kwargs)
+        self.operations = operations or OPERATIONS
+        self.plans = {}
+
+    def plan(self, expression):
+        if expression not in self.plans:
+            commands = []
+
+            def visit(node):
+                if isinstance(node, ast.Constant):
+                    return node.value
+                if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+                    return -visit(node.operand)
+                if isinstance(node, ast.BinOp) and type(node.op) in self.operations:
+                    a, b = visit(node.left), visit(node.right)
+                    commands.append(f"{self.operations[type(node.op)]}({a}, {b})")
+                    return OPERATORS[type(node.op)](a, b)
+                raise ValueError(f"Unsupported expression {ast.dump(node)}")
+
+            visit(ast.parse(expression, mode="eval").body)
+            self.plans[expression] = commands
+        return self.plans[expression]
+
+    def reply(self, messages):
+        prompt_index = max(
+            (index for index, message in enumerate(messages) if message["role"] == "user" and EXPRESSION.search(str(message["content"]))),
+            default=None,
+        )
+        if prompt_index is None:
+            return "Stop()"
+        commands = self.plan(EXPRESSION.findall(messages[prompt_index]["content"])[-1])
+        done = 0
+        for message in messages[prompt_index + 1:]:
+            if message["role"] == "assistant" and done < len(commands) and message["content"] == commands[done]:
+                done += 1
+        return commands[done] if done < len(commands) else "Stop()"
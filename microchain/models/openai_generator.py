@@ -1,13 +1,37 @@
-from microchain.models.generator import Generator
-from termcolor import colored
+from microchain.models.generator import Generator, TokenUsage, ToolCall, ToolReply, parse_tool_arguments, provider_error
+from microchain.models.transport import get_default_transport
+from microchain.log import log, DEBUG, WARNING, ERROR
 try:
-    from openai import OpenAI
+    from openai import OpenAI, AsyncOpenAI
 except ImportError:
     raise ImportError("Error! Try pip install openai before using this generator")
-from openai import OpenAIError
+from openai import OpenAIError, APIStatusError
+
+PROMPT_CACHE_MODES = (None, "local", "hosted")
+GRAMMAR_MODES = (None, "gbnf", "regex")
+
+def cached_prompt_tokens(response):
+    # OpenAI reports usage.prompt_tokens_details.cached_tokens, llama.cpp-style
+    # servers report timings.cache_n. Neither is modelled by this openai version.
+    details = getattr(response.usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+    if details is not None:
+        return getattr(details, "cached_tokens", 0) or 0
+    timings = getattr(response, "timings", None)
+    if isinstance(timings, dict):
+        return timings.get("cache_n") or 0
+    return 0
+
+def generator_error(error):
+    if isinstance(error, APIStatusError):
+        return provider_error(error, error.status_code, error.response.headers)
+    return provider_error(error)
 
 class OpenAIChatGenerator(Generator):
-    def __init__(self, *, model, api_key, api_base=None, temperature=0.9, top_p=1, max_tokens=512, timeout=30):
+    provider = "openai"
+
+    def __init__(self, *, model, api_key, api_base=None, temperature=0.9, top_p=1, max_tokens=512, timeout=30, stream=False, prompt_cache=None, grammar=None, tool_calling=False, tool_choice=None, transport=None):
         self.model = model
         self.api_key = api_key
         self.api_base = api_base
@@ -15,34 +39,172 @@ class OpenAIChatGenerator(Generator):
         self.top_p = top_p
         self.max_tokens = max_tokens
         self.timeout = timeout
+        self.stream = stream
+        if prompt_cache not in PROMPT_CACHE_MODES:
+            raise ValueError(f"prompt_cache must be one of {PROMPT_CACHE_MODES}")
+        # "local": ask llama.cpp-style servers to keep the KV cache of the shared prefix
+        # "hosted": route requests with the same static prefix together (prompt_cache_key)
+        self.prompt_cache = prompt_cache
+        if grammar not in GRAMMAR_MODES:
+            raise ValueError(f"grammar must be one of {GRAMMAR_MODES}")
+        # "gbnf": llama.cpp servers, "regex": vLLM guided decoding. The agent sends
+        # the grammar compiled from the engine's functions with every request.
+        self.grammar = grammar
+        # Send the engine's functions as `tools` and dispatch the returned tool_calls
+        # directly; tool_choice="required" forces a call on servers that support it
+        self.tool_calling = tool_calling
+        self.tool_choice = tool_choice
+        self.last_stream_stats = None
 
+        # Connections are pooled in a Transport shared by every generator in the process.
+        # The SDK's own retries are off: ResilientGenerator owns the retry policy.
+        self.transport = transport or get_default_transport()
         self.client = OpenAI(
             api_key=self.api_key,
-            base_url=self.api_base
+            base_url=self.api_base,
+            http_client=self.transport.client_for(self.api_base),
+            max_retries=0
         )
-    
-    def __call__(self, messages, stop=None):
+
+    def cache_body(self, cache_key=None):
+        if self.prompt_cache == "local":
+            return dict(cache_prompt=True)
+        if self.prompt_cache == "hosted" and cache_key:
+            return dict(prompt_cache_key=cache_key)
+        return None
+
+    def grammar_body(self, grammar=None):
+        if not grammar or self.grammar is None:
+            return None
+        if self.grammar == "gbnf":
+            return dict(grammar=grammar)
+        return dict(guided_regex=grammar)
+
+    def request_kwargs(self, messages, stop=None, cache_key=None, grammar=None, tools=None):
         assert isinstance(messages, list), "messages must be a list of messages https://platform.openai.com/docs/guides/text-generation/chat-completions-api"
+        kwargs = dict(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            top_p=self.top_p,
+            stop=stop,
+            timeout=self.timeout
+        )
+        if tools:
+            kwargs["tools"] = tools
+            if self.tool_choice:
+                kwargs["tool_choice"] = self.tool_choice
+        extra_body = dict()
+        extra_body.update(self.cache_body(cache_key) or {})
+        extra_body.update(self.grammar_body(grammar) or {})
+        if extra_body:
+            kwargs["extra_body"] = extra_body
+        return kwargs
+
+    def parse_usage(self, response):
+        usage = response.usage
+        total_tokens = TokenUsage(
+            usage.total_tokens or 0,
+            prompt_tokens=usage.prompt_tokens or 0,
+            completion_tokens=usage.completion_tokens or 0,
+            cached_tokens=cached_prompt_tokens(response),
+        )
+        if total_tokens.cached_tokens:
+            log(DEBUG, 'Used %s tokens (%s cached)', total_tokens, total_tokens.cached_tokens)
+        else:
+            log(DEBUG, 'Used %s tokens', total_tokens)
+        return total_tokens
+
+    def choice_output(self, choice):
+        if choice.message.tool_calls:
+            return ToolReply([
+                ToolCall(call.function.name, parse_tool_arguments(call.function.arguments), id=call.id)
+                for call in choice.message.tool_calls
+            ], content=choice.message.content)
+        output = choice.message.content
+        if output is None:
+            log(WARNING, 'openai_generator returned None. Replacing with empty string.')
+            output = ''
+        return output
+
+    def parse_response(self, response):
+        total_tokens = self.parse_usage(response)
+        return self.choice_output(response.choices[0]), total_tokens
+
+    def parse_candidates(self, response):
+        total_tokens = self.parse_usage(response)
+        return [self.choice_output(choice) for choice in response.choices], total_tokens
 
+    def stream_response(self, kwargs, command_parser=None):
+        stream = self.client.chat.completions.create(stream=True, **kwargs)
+        return self.collect_stream(stream, kwargs["messages"], command_parser)
+    
+    def __call__(self, messages, stop=None, command_parser=None, cache_key=None, grammar=None, tools=None):
+        kwargs = self.request_kwargs(messages, stop=stop, cache_key=cache_key, grammar=grammar, tools=tools)
+        try:
+            if self.stream and not tools:
+                return self.stream_response(kwargs, command_parser)
+            response = self.client.chat.completions.create(**kwargs)
+        except OpenAIError as e:
+            log(ERROR, "Error: %s", e, color="red")
+            raise generator_error(e) from e
+        return self.parse_response(response)
+
+    def candidates(self, messages, n, stop=None, cache_key=None, grammar=None, tools=None, **kwargs):
+        if self.stream and not tools:
+            # Keep the early cut-off by streaming n separate calls
+            return super().candidates(messages, n, stop=stop, cache_key=cache_key, grammar=grammar, tools=tools, **kwargs)
+        # One request with n choices; servers that ignore `n` return fewer
+        request = self.request_kwargs(messages, stop=stop, cache_key=cache_key, grammar=grammar, tools=tools)
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                top_p=self.top_p,
-                stop=stop,
-                timeout=self.timeout
+            response = self.client.chat.completions.create(n=n, **request)
+        except OpenAIError as e:
+            log(ERROR, "Error: %s", e, color="red")
+            raise generator_error(e) from e
+        return self.parse_candidates(response)
+
+class AsyncOpenAIChatGenerator(OpenAIChatGenerator):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.async_client = None
+        self.async_http_client = None
+
+    def get_async_client(self):
+        # The transport hands out one pool per event loop, rebuild the client if the loop changed
+        http_client = self.transport.async_client_for(self.api_base)
+        if http_client is not self.async_http_client:
+            self.async_http_client = http_client
+            self.async_client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.api_base,
+                http_client=http_client,
+                max_retries=0
             )
+        return self.async_client
+
+    async def astream_response(self, kwargs, command_parser=None):
+        stream = await self.get_async_client().chat.completions.create(stream=True, **kwargs)
+        return await self.acollect_stream(stream, kwargs["messages"], command_parser)
+
+    async def acall(self, messages, stop=None, command_parser=None, cache_key=None, grammar=None, tools=None):
+        kwargs = self.request_kwargs(messages, stop=stop, cache_key=cache_key, grammar=grammar, tools=tools)
+        try:
+            if self.stream and not tools:
+                return await self.astream_response(kwargs, command_parser)
+            response = await self.get_async_client().chat.completions.create(**kwargs)
         except OpenAIError as e:
-            print(colored(f"Error: {e}", "red"))
-            return "Error: timeout"
-        
-        total_tokens = response.usage.total_tokens or 0
-        print(f'Used {total_tokens} tokens')
-        output = response.choices[0].message.content
-        if output is None:
-            print('openai_generator returned None. Replacing with empty string.')
-            output = ''
-        return output, total_tokens
- 
\ No newline at end of file
+            log(ERROR, "Error: %s", e, color="red")
+            raise generator_error(e) from e
+        return self.parse_response(response)
+
+    async def acandidates(self, messages, n, stop=None, cache_key=None, grammar=None, tools=None, **kwargs):
+        if self.stream and not tools:
+            return await super().acandidates(messages, n, stop=stop, cache_key=cache_key, grammar=grammar, tools=tools, **kwargs)
+        request = self.request_kwargs(messages, stop=stop, cache_key=cache_key, grammar=grammar, tools=tools)
+        try:
+            response = await self.get_async_client().chat.completions.create(n=n, **request)
+        except OpenAIError as e:
+            log(ERROR, "Error: %s", e, color="red")
+            raise generator_error(e) from e
+        return self.parse_candidates(response)
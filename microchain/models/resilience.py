@@ -0,0 +1,188 @@
+import asyncio
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from time import time, sleep
+
+from microchain.models.generator import GeneratorWrapper, GeneratorError, fresh_kwargs
+from microchain.tracing import current_span
+from microchain.log import log, WARNING
+
+LATENCY_WINDOW = 200
+ATTEMPT_LOG_SIZE = 1000
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class ResilientGenerator(GeneratorWrapper):
+    # Retries each generator with exponential backoff and full jitter, honours
+    # Retry-After, optionally hedges slow calls, then fails over to the next
+    # generator in the list (e.g. a local api_base first, hosted Mistral second).
+    def __init__(self, generators, max_attempts=3, base_delay=0.5, max_delay=30.0, hedge_percentile=None, hedge_min_samples=20):
+        if not isinstance(generators, list):
+            generators = [generators]
+        if not generators:
+            raise ValueError("ResilientGenerator needs at least one generator")
+        self.generators = generators
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # e.g. 0.95: send a duplicate request once a call is slower than the p95 latency
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+
+        self.latencies = [deque(maxlen=LATENCY_WINDOW) for _ in generators]
+        self.attempts = deque(maxlen=ATTEMPT_LOG_SIZE)
+        self.lock = threading.Lock()
+        self.pool = None
+
+    wrapped_field = "generators"
+
+    def primary(self):
+        return self.generators[0]
+
+    def backoff(self, attempt, error):
+        # None when the server asks for a longer wait than max_delay, the caller fails over instead
+        if error.retry_after is not None and error.retry_after > self.max_delay:
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if error.retry_after is not None:
+            delay = max(delay, error.retry_after)
+        return delay
+
+    def hedge_delay(self, index):
+        if self.hedge_percentile is None:
+            return None
+        with self.lock:
+            samples = list(self.latencies[index])
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return percentile(samples, self.hedge_percentile)
+
+    def record(self, index, attempt, start_time, error=None, hedged=False):
+        latency = time() - start_time
+        entry = dict(
+            generator=index,
+            model=getattr(self.generators[index], "model", None),
+            attempt=attempt,
+            latency=round(latency, 4),
+            hedged=hedged,
+            error=str(error) if error is not None else None,
+        )
+        current_span().event("llm.attempt", **entry)
+        with self.lock:
+            if error is None:
+                self.latencies[index].append(latency)
+            self.attempts.append(entry)
+
+    def call_hedged(self, generator, delay, messages, kwargs):
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(thread_name_prefix="microchain-hedge")
+        # Each request gets its own stream parser, two streams cannot share one
+        futures = [self.pool.submit(generator, messages, **fresh_kwargs(kwargs))]
+        done, _ = wait(futures, timeout=delay)
+        hedged = not done
+        if hedged:
+            futures.append(self.pool.submit(generator, messages, **fresh_kwargs(kwargs)))
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The slower request cannot be cancelled mid-flight, its result is dropped
+                    return future.result(), hedged
+                error = future.exception()
+        raise error
+
+    async def acall_hedged(self, generator, delay, messages, kwargs):
+        tasks = [asyncio.ensure_future(generator.acall(messages, **fresh_kwargs(kwargs)))]
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        hedged = not done
+        if hedged:
+            tasks.append(asyncio.ensure_future(generator.acall(messages, **fresh_kwargs(kwargs))))
+        error = None
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result(), hedged
+                    error = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise error
+
+    def request(self, index, generator, messages, kwargs):
+        delay = self.hedge_delay(index)
+        if delay is None:
+            return generator(messages, **kwargs), False
+        return self.call_hedged(generator, delay, messages, kwargs)
+
+    async def arequest(self, index, generator, messages, kwargs):
+        delay = self.hedge_delay(index)
+        if delay is None:
+            return await generator.acall(messages, **kwargs), False
+        return await self.acall_hedged(generator, delay, messages, kwargs)
+
+    def run(self, request):
+        # request(index, generator) -> (result, hedged), retried then failed over
+        error = None
+        for index, generator in enumerate(self.generators):
+            for attempt in range(self.max_attempts):
+                start_time = time()
+                try:
+                    result, hedged = request(index, generator)
+                except GeneratorError as e:
+                    error = e
+                    self.record(index, attempt, start_time, error=e)
+                    delay = self.backoff(attempt, e) if e.retryable and attempt < self.max_attempts - 1 else None
+                    if delay is None:
+                        break
+                    sleep(delay)
+                    continue
+                self.record(index, attempt, start_time, hedged=hedged)
+                return result
+            if index < len(self.generators) - 1:
+                log(WARNING, "Generator %s failed (%s), failing over", index, error)
+        raise error
+
+    async def arun(self, request):
+        error = None
+        for index, generator in enumerate(self.generators):
+            for attempt in range(self.max_attempts):
+                start_time = time()
+                try:
+                    result, hedged = await request(index, generator)
+                except GeneratorError as e:
+                    error = e
+                    self.record(index, attempt, start_time, error=e)
+                    delay = self.backoff(attempt, e) if e.retryable and attempt < self.max_attempts - 1 else None
+                    if delay is None:
+                        break
+                    await asyncio.sleep(delay)
+                    continue
+                self.record(index, attempt, start_time, hedged=hedged)
+                return result
+            if index < len(self.generators) - 1:
+                log(WARNING, "Generator %s failed (%s), failing over", index, error)
+        raise error
+
+    def __call__(self, messages, **kwargs):
+        return self.run(lambda index, generator: self.request(index, generator, messages, kwargs))
+
+    async def acall(self, messages, **kwargs):
+        return await self.arun(lambda index, generator: self.arequest(index, generator, messages, kwargs))
+
+    def candidates(self, messages, n, **kwargs):
+        # The n samples come from one generator, a failed batch is retried or failed over as a whole
+        return self.run(lambda index, generator: (generator.candidates(messages, n, **kwargs), False))
+
+    async def acandidates(self, messages, n, **kwargs):
+        async def request(index, generator):
+            return await generator.acandidates(messages, n, **kwargs), False
+        return await self.arun(request)
@@ -0,0 +1,85 @@
+from functools import lru_cache
+
+from microchain.log import log, WARNING
+
+# OpenAI's chat format spends ~4 tokens per message on role and separators
+MESSAGE_OVERHEAD_TOKENS = 4
+COUNT_CACHE_SIZE = 8192
+
+def message_text(message):
+    # Native tool calls carry the call in tool_calls and no content
+    text = message.get("content") or ""
+    for call in message.get("tool_calls") or ():
+        text += call["function"]["name"] + call["function"]["arguments"]
+    return text
+
+def approximate_tokens(text):
+    # ~4 characters per token for English text and code
+    return max(1, len(text) // 4) if text else 0
+
+class TokenCounter:
+    def __init__(self):
+        # History messages are re-counted on every step, so memoize per string
+        self.count = lru_cache(maxsize=COUNT_CACHE_SIZE)(self.count_text)
+
+    def count_text(self, text):
+        raise NotImplementedError
+
+    def count_messages(self, messages):
+        if isinstance(messages, str):
+            return self.count(messages)
+        return sum(self.count(message_text(message)) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+class HeuristicTokenCounter(TokenCounter):
+    def count_text(self, text):
+        return approximate_tokens(text)
+
+class TiktokenCounter(TokenCounter):
+    def __init__(self, model):
+        super().__init__()
+        try:
+            import tiktoken
+        except ImportError:
+            raise ImportError("Please install tiktoken python library using pip install tiktoken")
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count_text(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+class HFTokenCounter(TokenCounter):
+    def __init__(self, tokenizer_name):
+        super().__init__()
+        try:
+            import transformers
+        except ImportError:
+            raise ImportError("Please install transformers python library using pip install transformers")
+        self.tokenizer = transformers.AutoTokenizer.from_pretrained(tokenizer_name)
+
+    def count_text(self, text):
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+HEURISTIC_COUNTER = HeuristicTokenCounter()
+
+# model name prefix -> factory(model) returning a TokenCounter
+TOKEN_COUNTERS = {
+    "gpt-": TiktokenCounter,
+}
+
+def register_token_counter(prefix, factory):
+    TOKEN_COUNTERS[prefix] = factory
+    get_token_counter.cache_clear()
+
+@lru_cache(maxsize=None)
+def get_token_counter(model):
+    for prefix, factory in TOKEN_COUNTERS.items():
+        if model and model.startswith(prefix):
+            try:
+                return factory(model)
+            except Exception as e:
+                # Missing package or tokenizer files (e.g. offline): estimate instead
+                log(WARNING, "Token counter for %s unavailable (%s), using heuristic", model, type(e).__name__)
+                break
+    return HEURISTIC_COUNTER
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import weakref
+from urllib.parse import urlsplit
+
+import httpx
+
+class Transport:
+    # Shared keep-alive HTTP clients for generators. One pool per host, so each
+    # host can get its own connection limit; async pools are kept per event loop
+    # because httpx connections cannot move between loops.
+    def __init__(self, max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0, http2=False, timeout=60.0, connect_timeout=5.0, retries=0, host_limits=None):
+        if http2:
+            try:
+                import h2
+            except ImportError:
+                raise ImportError("Please install HTTP/2 support using pip install httpx[http2]")
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.retries = retries
+        # host -> max connections for that host
+        self.host_limits = host_limits or {}
+
+        self.clients = {}
+        self.async_clients = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+        self.streams = weakref.WeakSet()
+        self.requests = 0
+        self.connections_opened = 0
+
+    def limits_for(self, host):
+        max_connections = self.host_limits.get(host, self.max_connections)
+        return httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=min(self.max_keepalive_connections, max_connections),
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def record(self, response):
+        # Every connection has one network stream for its lifetime, so an unseen
+        # stream means a new TCP/TLS connection was opened for this request.
+        stream = response.extensions.get("network_stream")
+        with self.lock:
+            self.requests += 1
+            if stream is not None and stream not in self.streams:
+                self.streams.add(stream)
+                self.connections_opened += 1
+
+    async def arecord(self, response):
+        self.record(response)
+
+    def client_for(self, base_url):
+        host = urlsplit(base_url).netloc if base_url else "default"
+        with self.lock:
+            if host not in self.clients:
+                self.clients[host] = httpx.Client(
+                    timeout=self.timeout,
+                    transport=httpx.HTTPTransport(http2=self.http2, retries=self.retries, limits=self.limits_for(host)),
+                    event_hooks={"response": [self.record]},
+                    follow_redirects=True,
+                )
+            return self.clients[host]
+
+    def async_client_for(self, base_url):
+        host = urlsplit(base_url).netloc if base_url else "default"
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            clients = self.async_clients.setdefault(loop, {})
+            if host not in clients:
+                clients[host] = httpx.AsyncClient(
+                    timeout=self.timeout,
+                    transport=httpx.AsyncHTTPTransport(http2=self.http2, retries=self.retries, limits=self.limits_for(host)),
+                    event_hooks={"response": [self.arecord]},
+                    follow_redirects=True,
+                )
+            return clients[host]
+
+    @property
+    def stats(self):
+        with self.lock:
+            return dict(
+                requests=self.requests,
+                connections_opened=self.connections_opened,
+                connections_reused=self.requests - self.connections_opened,
+            )
+
+    def close(self):
+        with self.lock:
+            for client in self.clients.values():
+                client.close()
+            self.clients = {}
+
+default_transport = None
+default_transport_lock = threading.Lock()
+
+def get_default_transport():
+    global default_transport
+    with default_transport_lock:
+        if default_transport is None:
+            default_transport = Transport()
+        return default_transport
+
+def set_default_transport(transport):
+    global default_transport
+    with default_transport_lock:
+        default_transport = transport
@@ -0,0 +1,192 @@
+import os
+import json
+import threading
+import contextvars
+from collections import deque
+from time import time_ns
+
+current = contextvars.ContextVar("microchain_span", default=None)
+
+def otel_value(value):
+    if isinstance(value, bool):
+        return dict(boolValue=value)
+    if isinstance(value, int):
+        return dict(intValue=str(value))
+    if isinstance(value, float):
+        return dict(doubleValue=value)
+    return dict(stringValue=str(value))
+
+def otel_attributes(attributes):
+    return [dict(key=key, value=otel_value(value)) for key, value in attributes.items() if value is not None]
+
+class Span:
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "start", "end", "attributes", "events", "error", "token")
+
+    def __init__(self, tracer, name, parent, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start = None
+        self.end = None
+        self.attributes = attributes
+        self.events = []
+        self.error = None
+        self.token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def event(self, name, **attributes):
+        self.events.append(dict(name=name, time=time_ns(), attributes=attributes))
+
+    @property
+    def duration(self):
+        if self.end is None:
+            return None
+        return (self.end - self.start) / 1e9
+
+    def __enter__(self):
+        self.start = time_ns()
+        self.token = current.set(self)
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        self.end = time_ns()
+        current.reset(self.token)
+        if error is not None:
+            self.error = f"{kind.__name__}: {error}"
+        self.tracer.export(self)
+        return False
+
+    def record(self):
+        return dict(
+            name=self.name,
+            trace_id=self.trace_id,
+            span_id=self.span_id,
+            parent_id=self.parent_id,
+            start=self.start / 1e9,
+            duration=round(self.duration, 6),
+            attributes=self.attributes,
+            events=self.events,
+            error=self.error,
+        )
+
+    def otel(self):
+        # One span of the OTLP/JSON encoding (resourceSpans[].scopeSpans[].spans[])
+        return dict(
+            traceId=self.trace_id,
+            spanId=self.span_id,
+            parentSpanId=self.parent_id or "",
+            name=self.name,
+            kind=1,
+            startTimeUnixNano=str(self.start),
+            endTimeUnixNano=str(self.end),
+            attributes=otel_attributes(self.attributes),
+            events=[
+                dict(timeUnixNano=str(event["time"]), name=event["name"], attributes=otel_attributes(event["attributes"]))
+                for event in self.events
+            ],
+            status=dict(code=2, message=self.error) if self.error else dict(code=1),
+        )
+
+class NullSpan:
+    # Returned while tracing is off so instrumented code costs one method call
+    __slots__ = ()
+
+    def set(self, **attributes):
+        return self
+
+    def event(self, name, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Tracer:
+    def __init__(self, exporters=None):
+        self.exporters = exporters or []
+
+    @property
+    def enabled(self):
+        return bool(self.exporters)
+
+    def span(self, name, **attributes):
+        if not self.exporters:
+            return NULL_SPAN
+        return Span(self, name, current.get(), attributes)
+
+    def export(self, span):
+        for exporter in self.exporters:
+            exporter.export(span)
+
+    def close(self):
+        for exporter in self.exporters:
+            exporter.close()
+
+class JSONLExporter:
+    # format="json" writes Span.record(), format="otlp" writes OTLP/JSON spans
+    def __init__(self, path, format="json"):
+        if format not in ("json", "otlp"):
+            raise ValueError("format must be json or otlp")
+        self.path = path
+        self.format = format
+        self.lock = threading.Lock()
+        self.file = open(path, "a")
+
+    def export(self, span):
+        line = json.dumps(span.otel() if self.format == "otlp" else span.record(), default=str)
+        with self.lock:
+            self.file.write(line + "\n")
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class MemoryExporter:
+    def __init__(self, max_spans=10000):
+        self.spans = deque(maxlen=max_spans)
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def close(self):
+        pass
+
+    def summary(self):
+        # Latency per span name in seconds, to see where the time goes
+        durations = {}
+        for span in list(self.spans):
+            durations.setdefault(span.name, []).append(span.duration)
+        summary = {}
+        for name, values in durations.items():
+            values.sort()
+            summary[name] = dict(
+                count=len(values),
+                total=round(sum(values), 4),
+                mean=round(sum(values) / len(values), 4),
+                p50=round(values[len(values) // 2], 4),
+                p95=round(values[min(len(values) - 1, int(0.95 * len(values)))], 4),
+                max=round(values[-1], 4),
+            )
+        return summary
+
+default_tracer = Tracer()
+
+def get_tracer():
+    return default_tracer
+
+def set_tracer(tracer):
+    global default_tracer
+    default_tracer = tracer if tracer is not None else Tracer()
+
+def current_span():
+    span = current.get()
+    return span if span is not None else NULL_SPAN
@@ -0,0 +1,7 @@
+import pytest
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # Agents without a run_store write logs/history-<run id>.json to the working directory
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
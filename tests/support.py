@@ -0,0 +1,25 @@
+from microchain import Agent, LLM, ScriptedGenerator
+from microchain.benchmark import build_engine
+from microchain.models.mock_generator import CalcOracleGenerator
+
+class ToolScriptedGenerator(ScriptedGenerator):
+    # Replays ToolReply objects, like OpenAIChatGenerator(tool_calling=True)
+    tool_calling = True
+
+class CrashingOracle(CalcOracleGenerator):
+    # Dies on call number `crash_at`, like a preempted worker
+    def __init__(self, crash_at, **kwargs):
+        super().__init__(**kwargs)
+        self.crash_at = crash_at
+
+    def reply(self, messages):
+        if self.calls == self.crash_at:
+            raise RuntimeError("preempted")
+        return super().reply(messages)
+
+def build_calc_agent(generator, prompt="Evaluate `(1+2)*(3-1)`", agent_class=Agent, engine=None, **kwargs):
+    engine = engine if engine is not None else build_engine()
+    agent = agent_class(llm=LLM(generator=generator), engine=engine, **kwargs)
+    agent.system_message = f"Act as a calculator. Allowed functions:\n{engine.help}"
+    agent.prompt = prompt
+    return agent
@@ -0,0 +1,42 @@
+import asyncio
+import os
+
+from microchain import Agent, AsyncAgent, ScriptedGenerator, ToolCall, ToolReply
+from microchain.benchmark import expression
+from microchain.models.mock_generator import CalcOracleGenerator
+from tests.support import ToolScriptedGenerator, build_calc_agent
+
+PROMPT = f"Evaluate `{expression(2)}`"
+
+def test_sync_and_async_agents_take_the_same_steps():
+    sync = build_calc_agent(CalcOracleGenerator(), prompt=PROMPT, max_steps=30)
+    sync.run()
+    concurrent = [build_calc_agent(CalcOracleGenerator(), prompt=PROMPT, agent_class=AsyncAgent, max_steps=30) for _ in range(3)]
+
+    async def run_all():
+        return await asyncio.gather(*(agent.arun() for agent in concurrent))
+
+    asyncio.run(run_all())
+    assert sync.finish_reason == "Completed"
+    assert str(eval(expression(2))) in [message["content"] for message in sync.history]
+    for agent in concurrent:
+        assert agent.history == sync.history
+        assert agent.step_count == sync.step_count
+    # Without a run_store every run is saved to logs/
+    assert len(os.listdir("logs")) == 4
+
+def test_failed_commands_are_retried_within_a_step():
+    agent = build_calc_agent(ScriptedGenerator(["Add(1)", "Add(1, 2)", "Stop()"]), max_tries=3)
+    agent.run()
+    assert agent.finish_reason == "Completed"
+    assert agent.step_count == 2
+
+def test_tool_calls_keep_the_reply_text():
+    replies = [ToolReply([ToolCall("Add", {"a": 1, "b": 2}, id="call_1")], content="First the sum")]
+    for agent_class in (Agent, AsyncAgent):
+        agent = build_calc_agent(ToolScriptedGenerator(replies), agent_class=agent_class)
+        agent.run()
+        call, result = agent.history[2:4]
+        assert call["content"] == "First the sum"
+        assert call["tool_calls"][0]["id"] == "call_1"
+        assert result == dict(role="tool", tool_call_id="call_1", content="3")
@@ -0,0 +1,72 @@
+import pytest
+
+from microchain import CachedGenerator, CacheMiss, MemoryResponseStore, SQLiteResponseStore, ScriptedGenerator, ToolCall, ToolReply
+from tests.support import ToolScriptedGenerator, build_calc_agent
+
+MESSAGES = [dict(role="user", content="Evaluate `1+2`")]
+
+def tool_replies():
+    return [
+        ToolReply([ToolCall("Add", {"a": 1, "b": 2})], content="Adding first"),
+        ToolReply([ToolCall("Multiply", {"a": 3, "b": 2}), ToolCall("Stop", {})]),
+    ]
+
+def test_read_write_serves_repeated_requests():
+    generator = ScriptedGenerator(["Add(1, 2)"])
+    cached = CachedGenerator(generator)
+    first = cached(MESSAGES)
+    second = cached(MESSAGES)
+    assert first[0] == second[0] == "Add(1, 2)"
+    assert int(second[1]) == 0
+    assert generator.calls == 1
+    assert (cached.hits, cached.misses) == (1, 1)
+
+def test_sampled_requests_are_not_cached():
+    generator = ScriptedGenerator(["Add(1, 2)", "Add(2, 1)"])
+    generator.temperature = 0.7
+    cached = CachedGenerator(generator)
+    assert cached(MESSAGES)[0] != cached(MESSAGES)[0]
+    assert generator.calls == 2
+
+def test_replay_raises_on_a_miss():
+    cached = CachedGenerator(ScriptedGenerator([]), mode="replay")
+    with pytest.raises(CacheMiss):
+        cached(MESSAGES)
+
+def test_wrapper_exposes_the_wrapped_generator():
+    cached = CachedGenerator(ToolScriptedGenerator([]))
+    assert cached.provider == "mock"
+    assert cached.tool_calling is True
+
+@pytest.mark.parametrize("store_type", ["memory", "sqlite"])
+def test_tool_calling_run_replays_from_the_store(store_type, tmp_path):
+    path = str(tmp_path / "responses.db")
+    store = MemoryResponseStore() if store_type == "memory" else SQLiteResponseStore(path)
+    recorded = build_calc_agent(CachedGenerator(ToolScriptedGenerator(tool_replies()), store=store, mode="record"))
+    recorded.run()
+    assert recorded.finish_reason == "Completed"
+
+    if store_type == "sqlite":
+        # A fresh connection, as in a later test session
+        store.close()
+        store = SQLiteResponseStore(path)
+    offline = ToolScriptedGenerator([])
+    replayed = build_calc_agent(CachedGenerator(offline, store=store, mode="replay"))
+    replayed.run()
+
+    assert offline.calls == 0
+    assert replayed.finish_reason == "Completed"
+    assert [message["content"] for message in replayed.history if message["role"] == "tool"] == ["3", "6", ""]
+    assert replayed.history == recorded.history
+    assistant = [message for message in replayed.history if message.get("tool_calls")]
+    assert [message["tool_calls"][0]["function"]["name"] for message in assistant] == ["Add", "Multiply", "Stop"]
+    assert assistant[0]["content"] == "Adding first"
+
+def test_replayed_reply_keeps_its_tool_calls():
+    store = MemoryResponseStore()
+    CachedGenerator(ToolScriptedGenerator(tool_replies()), store=store, mode="record")(MESSAGES)
+    reply, tokens = CachedGenerator(ToolScriptedGenerator([]), store=store, mode="replay")(MESSAGES)
+    assert isinstance(reply, ToolReply)
+    assert [(call.name, call.arguments) for call in reply.tool_calls] == [("Add", {"a": 1, "b": 2})]
+    assert reply.content == "Adding first"
+    assert int(tokens) == 0
@@ -0,0 +1,75 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from microchain import Agent, AsyncAgent, FileCheckpointer
+from microchain.benchmark import expression
+from microchain.models.mock_generator import CalcOracleGenerator
+from tests.support import CrashingOracle, build_calc_agent
+
+PROMPT = f"Evaluate `{expression(2)}`"
+
+def answer():
+    return str(eval(expression(2)))
+
+def crash(path, agent_class, crash_at=4):
+    agent = build_calc_agent(CrashingOracle(crash_at), prompt=PROMPT, agent_class=agent_class, max_steps=30, checkpointer=FileCheckpointer(path))
+    with pytest.raises(RuntimeError):
+        agent.run()
+    return agent
+
+@pytest.mark.parametrize("agent_class", [Agent, AsyncAgent])
+def test_resume_continues_after_the_last_completed_step(agent_class, tmp_path):
+    path = str(tmp_path / "checkpoints" / "run.json")
+    crashed = crash(path, agent_class)
+    assert os.path.exists(path)
+    with open(path) as f:
+        assert json.load(f)["step_count"] == 3
+
+    oracle = CalcOracleGenerator()
+    resumed = build_calc_agent(oracle, prompt=PROMPT, max_steps=30, checkpointer=FileCheckpointer(path))
+    resumed.run(resume=True)
+
+    assert resumed.run_id == crashed.run_id
+    assert resumed.finish_reason == "Completed"
+    # Only the operations left after the crash, plus Stop()
+    assert oracle.calls == len(oracle.plan(expression(2))) - 3 + 1
+    contents = [message["content"] for message in resumed.history]
+    assert answer() in contents
+    assert not os.path.exists(path)
+
+def test_resume_without_a_checkpoint_starts_fresh(tmp_path):
+    oracle = CalcOracleGenerator()
+    agent = build_calc_agent(oracle, prompt=PROMPT, max_steps=30, checkpointer=FileCheckpointer(str(tmp_path / "run.json")))
+    agent.run(resume=True)
+    assert agent.finish_reason == "Completed"
+    assert oracle.calls == len(oracle.plan(expression(2))) + 1
+
+def test_engine_state_is_restored(tmp_path):
+    path = str(tmp_path / "run.json")
+    agent = build_calc_agent(CrashingOracle(2), prompt=PROMPT, max_steps=30, checkpointer=FileCheckpointer(path))
+    agent.engine.state["notes"] = ["kept"]
+    with pytest.raises(RuntimeError):
+        agent.run()
+
+    resumed = build_calc_agent(CalcOracleGenerator(), prompt=PROMPT, max_steps=30, checkpointer=FileCheckpointer(path))
+    resumed.run(resume=True)
+    assert resumed.engine.state["notes"] == ["kept"]
+
+def test_async_checkpoint_writes_finish_before_arun_returns(tmp_path):
+    path = str(tmp_path / "run.json")
+    agents = [
+        build_calc_agent(CalcOracleGenerator(), prompt=PROMPT, agent_class=AsyncAgent, max_steps=30, checkpointer=FileCheckpointer(f"{path}.{index}"))
+        for index in range(3)
+    ]
+
+    async def run_all():
+        return await asyncio.gather(*(agent.arun() for agent in agents))
+
+    asyncio.run(run_all())
+    assert all(agent.finish_reason == "Completed" for agent in agents)
+    # Completed runs clear their checkpoint, and no late write brings it back
+    assert not any(os.path.exists(f"{path}.{index}") for index in range(3))
+    assert len(os.listdir("logs")) == 3
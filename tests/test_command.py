@@ -0,0 +1,57 @@
+import pytest
+
+from microchain.engine.command import ast_parse, fast_parse, parse_command
+from microchain.engine.function import FunctionResult
+
+FAST_COMMANDS = [
+    "Stop()",
+    "Add(1, 2)",
+    "Add(-1, 2.5)",
+    "Add(a=1, b=2)",
+    "Add(1, b=2)",
+    "Add( 1 ,  2 )",
+    "Power(1e3, .5)",
+    'Reasoning("plain text")',
+    "Reasoning('single quotes')",
+    "Flag(True, None, False)",
+    "Add(1, 2,)",
+]
+
+SLOW_COMMANDS = [
+    'Reasoning("escaped \\" quote")',
+    "Add(1 + 2, 3)",
+    "Add(b=1, 2)",
+    "Add(a=1, a=2)",
+    "Add(1, 2) # comment",
+    "Add(True=1)",
+    "Add(class=1)",
+    "class(1)",
+    "Add(x)",
+    "Add(1, 2",
+    "Add(1, 2); Stop()",
+    f"Add({'9' * 5000}, 1)",
+    f"Add(a={'9' * 5000})",
+]
+
+@pytest.mark.parametrize("command", FAST_COMMANDS)
+def test_fast_path_matches_ast(command):
+    parsed = fast_parse(command)
+    assert parsed is not None
+    assert ast_parse(command) == (FunctionResult.SUCCESS, parsed)
+
+@pytest.mark.parametrize("command", SLOW_COMMANDS)
+def test_other_commands_fall_back_to_ast(command):
+    assert fast_parse(command) is None
+    assert parse_command(command) == ast_parse(command)
+
+def test_oversized_int_is_an_error_not_an_exception():
+    result, message = parse_command(f"Add(a={'9' * 5000})")
+    assert result == FunctionResult.ERROR
+    assert message.startswith("Error:")
+
+def test_keyword_argument_names_are_rejected():
+    result, _ = parse_command("Add(class=1)")
+    assert result == FunctionResult.ERROR
+
+def test_parse_results_are_shared():
+    assert parse_command("Add(1, 2)") is parse_command("Add(1, 2)")
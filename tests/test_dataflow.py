@@ -0,0 +1,63 @@
+import threading
+
+from microchain import Engine, Function, FunctionResult, ScriptedGenerator
+from microchain.benchmark import Add, Multiply, Subtract
+from microchain.functions import Reasoning, Stop
+from tests.support import build_calc_agent
+
+class Rendezvous(Function):
+    # Only returns once `parties` calls are running at the same time
+    description = "Use Rendezvous(value: int) to wait for the other calls"
+    example_args = [1]
+    parallel_safe = True
+
+    def __init__(self, parties):
+        super().__init__()
+        self.barrier = threading.Barrier(parties, timeout=5)
+
+    def __call__(self, value: int):
+        self.barrier.wait()
+        return value
+
+def build_dataflow_engine(*functions):
+    engine = Engine(state=dict(), dataflow=True)
+    for function in (Reasoning(), Stop(), Add(), Subtract(), Multiply()) + functions:
+        engine.register(function)
+    return engine
+
+def bound(engine):
+    build_calc_agent(ScriptedGenerator([]), engine=engine)
+    engine.bind(object())
+    return engine
+
+def test_references_are_replaced_by_results():
+    engine = bound(build_dataflow_engine())
+    outcomes = engine.execute_plan(["Multiply(3, 9)", "Multiply(2, 1)", "Subtract($1, $2)"])
+    assert outcomes[-1] == ("Subtract(27, 2)", FunctionResult.SUCCESS, "25")
+
+def test_commands_after_a_failure_are_skipped():
+    engine = bound(build_dataflow_engine())
+    outcomes = engine.execute_plan(["Add(1, 'x')", "Add($1, 1)", "Add(2, 2)"])
+    assert outcomes[0][1] == FunctionResult.ERROR
+    assert outcomes[1] is None
+
+def test_forward_references_are_errors():
+    engine = bound(build_dataflow_engine())
+    command, result, output = engine.execute_plan(["Add($2, 1)", "Add(1, 1)"])[0]
+    assert result == FunctionResult.ERROR
+    assert "$1 to $0" in output or "earlier commands" in output
+
+def test_independent_parallel_safe_calls_run_concurrently():
+    engine = bound(build_dataflow_engine(Rendezvous(3)))
+    outcomes = engine.execute_plan(["Rendezvous(1)", "Rendezvous(2)", "Rendezvous(3)", "Add($1, $3)"])
+    assert [outcome[2] for outcome in outcomes] == ["1", "2", "3", "4"]
+
+def test_agent_runs_a_dataflow_plan():
+    engine = build_dataflow_engine()
+    agent = build_calc_agent(ScriptedGenerator(["Multiply(3, 9)\nMultiply(2, 1)\nSubtract($1, $2)\nStop()"]), engine=engine, plan_mode=True)
+    agent.run()
+    assert agent.finish_reason == "Completed"
+    assert agent.step_count == 4
+    # The history shows the values the references resolved to
+    contents = [message["content"] for message in agent.history]
+    assert contents[contents.index("Subtract(27, 2)") + 1] == "25"
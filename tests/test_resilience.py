@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from microchain import GeneratorError, MockGenerator, ResilientGenerator
+from microchain.models import resilience
+
+MESSAGES = [dict(role="user", content="hi")]
+
+class FlakyGenerator(MockGenerator):
+    # Raises the given errors in order, then answers `output`
+    def __init__(self, errors=(), output="ok", **kwargs):
+        super().__init__(**kwargs)
+        self.errors = list(errors)
+        self.output = output
+
+    def reply(self, messages):
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.output
+
+def busy(retry_after=None):
+    return GeneratorError("busy", retry_after=retry_after, status=429)
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    waited = []
+    monkeypatch.setattr(resilience, "sleep", waited.append)
+    return waited
+
+def test_retries_until_the_call_succeeds(sleeps):
+    primary = FlakyGenerator([busy(), busy()])
+    generator = ResilientGenerator(primary, max_attempts=3, base_delay=0.01)
+    assert generator(MESSAGES)[0] == "ok"
+    assert primary.calls == 3
+    assert len(sleeps) == 2
+    assert [attempt["error"] is None for attempt in generator.attempts] == [False, False, True]
+
+def test_waits_for_retry_after(sleeps):
+    primary = FlakyGenerator([busy(retry_after=2.0)])
+    generator = ResilientGenerator(primary, base_delay=0.01, max_delay=5.0)
+    assert generator(MESSAGES)[0] == "ok"
+    assert sleeps == [2.0]
+
+def test_retry_after_past_max_delay_fails_over_at_once(sleeps):
+    primary = FlakyGenerator([busy(retry_after=3600)])
+    backup = FlakyGenerator(output="backup")
+    generator = ResilientGenerator([primary, backup], max_delay=5.0)
+    assert generator(MESSAGES)[0] == "backup"
+    assert primary.calls == 1
+    assert sleeps == []
+
+def test_backoff_never_exceeds_max_delay():
+    generator = ResilientGenerator(FlakyGenerator(), base_delay=1.0, max_delay=2.0)
+    assert all(generator.backoff(attempt, busy()) <= 2.0 for attempt in range(10))
+    assert generator.backoff(0, busy(retry_after=2.0)) == 2.0
+    assert generator.backoff(0, busy(retry_after=2.5)) is None
+
+def test_permanent_errors_fail_over_without_retrying(sleeps):
+    primary = FlakyGenerator([GeneratorError("bad request", retryable=False, status=400)])
+    generator = ResilientGenerator([primary, FlakyGenerator(output="backup")])
+    assert generator(MESSAGES)[0] == "backup"
+    assert primary.calls == 1
+    assert sleeps == []
+
+def test_raises_the_last_error_when_every_generator_fails(sleeps):
+    generator = ResilientGenerator([FlakyGenerator([busy()] * 2), FlakyGenerator([busy()] * 2)], max_attempts=2, base_delay=0.01)
+    with pytest.raises(GeneratorError):
+        generator(MESSAGES)
+
+def test_candidates_fail_over_as_a_batch(sleeps):
+    primary = FlakyGenerator([GeneratorError("down", retryable=False)])
+    backup = FlakyGenerator(output="backup")
+    outputs, _ = ResilientGenerator([primary, backup]).candidates(MESSAGES, 3)
+    assert outputs == ["backup"] * 3
+
+def test_async_calls_fail_over():
+    primary = FlakyGenerator([GeneratorError("down", retryable=False)] * 3)
+    backup = FlakyGenerator(output="backup")
+    generator = ResilientGenerator([primary, backup])
+    assert asyncio.run(generator.acall(MESSAGES))[0] == "backup"
+    outputs, _ = asyncio.run(generator.acandidates(MESSAGES, 2))
+    assert outputs == ["backup"] * 2
@@ -0,0 +1,26 @@
+import threading
+
+import pytest
+
+from microchain import State
+
+def test_forks_do_not_see_each_others_changes():
+    prepared = State(dict(board=[0, 0], name="game"))
+    first, second = prepared.fork(), prepared.fork()
+    first["board"][0] = 1
+    second["name"] = "other"
+    assert prepared["board"] == [0, 0]
+    assert second["board"] == [0, 0]
+    assert first["name"] == "game"
+
+def test_shared_values_are_not_copied():
+    lock = threading.Lock()
+    prepared = State(dict(lock=lock, board=[0]), shared={"lock"})
+    fork = prepared.fork().fork()
+    assert fork["lock"] is lock
+    assert fork["board"] is not prepared["board"]
+
+def test_uncopyable_values_point_to_shared():
+    fork = State(dict(lock=threading.Lock())).fork()
+    with pytest.raises(TypeError, match="shared"):
+        fork["lock"]